@@ -0,0 +1,182 @@
+"""
+Benchmarks the COCO export engine against the previous per-image query
+strategy.
+
+Seeds a throwaway dataset into the configured MongoDB for every size, runs
+both strategies, and reports wall time and the number of commands sent to
+MongoDB (round trips). Seeded documents are removed afterwards.
+
+    python -m benchmarks.export_benchmark --sizes 1000 10000 100000 1000000
+"""
+from pymongo import monitoring
+
+import argparse
+import tempfile
+import time
+import os
+
+
+class CommandCounter(monitoring.CommandListener):
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Listeners must be registered before the client is created
+counter = CommandCounter()
+monitoring.register(counter)
+
+from database import (
+    fix_ids,
+    ImageModel,
+    AnnotationModel
+)
+# Importing workers connects to Config.MONGODB_HOST
+from workers.export_util import (
+    CocoWriter,
+    format_annotation,
+    iter_image_annotations
+)
+
+
+ANNOTATIONS_PER_IMAGE = 10
+DATASET_ID = -1
+CATEGORY_ID = -1
+
+
+def seed(num_annotations):
+    """ Inserts images and annotations for the benchmark dataset """
+    num_images = max(num_annotations // ANNOTATIONS_PER_IMAGE, 1)
+    images = ImageModel._get_collection()
+    annotations = AnnotationModel._get_collection()
+
+    # Negative ids will never collide with sequence generated ids
+    image_ids = range(-1, -num_images - 1, -1)
+    images.insert_many([{
+        '_id': image_id,
+        'dataset_id': DATASET_ID,
+        'path': f'/benchmark/{image_id}.jpg',
+        'file_name': f'{image_id}.jpg',
+        'width': 640,
+        'height': 480,
+        'deleted': False
+    } for image_id in image_ids])
+
+    batch = []
+    annotation_id = -1
+    for image_id in image_ids:
+        for _ in range(ANNOTATIONS_PER_IMAGE):
+            batch.append({
+                '_id': annotation_id,
+                'image_id': image_id,
+                'dataset_id': DATASET_ID,
+                'category_id': CATEGORY_ID,
+                'segmentation': [[10, 10, 20, 10, 20, 20, 10, 20]],
+                'area': 100,
+                'bbox': [10, 10, 10, 10],
+                'deleted': False
+            })
+            annotation_id -= 1
+
+            if len(batch) >= 10000:
+                annotations.insert_many(batch)
+                batch = []
+    if batch:
+        annotations.insert_many(batch)
+
+
+def clean():
+    ImageModel._get_collection().delete_many({'dataset_id': DATASET_ID})
+    AnnotationModel._get_collection().delete_many({'dataset_id': DATASET_ID})
+
+
+def queries():
+    images = ImageModel.objects(deleted=False, dataset_id=DATASET_ID)\
+        .only(*ImageModel.COCO_PROPERTIES)
+    annotations = AnnotationModel.objects(
+        deleted=False, dataset_id=DATASET_ID, category_id__in=[CATEGORY_ID])\
+        .only(*AnnotationModel.COCO_PROPERTIES)
+    return images, annotations
+
+
+def export_per_image(path):
+    """ Previous strategy: one annotation query per image """
+    images, annotations = queries()
+
+    with CocoWriter(path) as writer:
+        for image in images.no_cache():
+            found = annotations.filter(image_id=image.id).no_cache()
+            for annotation in found:
+                annotation = format_annotation(fix_ids(annotation))
+                if annotation is not None:
+                    writer.write_annotation(annotation)
+            writer.write_image(fix_ids(image))
+
+
+def export_merged(path):
+    """ Single sorted annotation cursor merged with the image cursor """
+    images, annotations = queries()
+    images = images.order_by('id').no_cache()
+    annotations = annotations.order_by('image_id', 'id').no_cache()
+
+    with CocoWriter(path) as writer:
+        for image, found in iter_image_annotations(images, annotations):
+            for annotation in found:
+                annotation = format_annotation(fix_ids(annotation))
+                if annotation is not None:
+                    writer.write_annotation(annotation)
+            writer.write_image(fix_ids(image))
+
+
+def measure(export, directory):
+    path = os.path.join(directory, f'{export.__name__}.json')
+
+    counter.count = 0
+    started_at = time.time()
+    export(path)
+    elapsed = time.time() - started_at
+
+    return elapsed, counter.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000],
+                        help='Number of annotations to export')
+    parser.add_argument('--skip-per-image', action='store_true',
+                        help='Only run the merged strategy')
+    args = parser.parse_args()
+
+    # Make sure the indexes exist before anything is timed
+    AnnotationModel.ensure_indexes()
+
+    strategies = [export_merged]
+    if not args.skip_per_image:
+        strategies.insert(0, export_per_image)
+
+    print(f"{'annotations':>12} {'strategy':>18} {'seconds':>10} {'round trips':>12}")
+    for size in args.sizes:
+        clean()
+        seed(size)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                for export in strategies:
+                    elapsed, round_trips = measure(export, directory)
+                    print(f"{size:>12} {export.__name__:>18} "
+                          f"{elapsed:>10.2f} {round_trips:>12}", flush=True)
+        finally:
+            clean()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmarks the thumbnail engine against the previous imantics rendering.
+
+Writes synthetic JPEGs at every resolution with random polygon
+annotations, and reports thumbnails per second for the previous path
+(full resolution decode and drawing, then downsizing), the new renderer
+in one process, and the new renderer in a pool of processes.
+
+    python -m benchmarks.thumbnail_benchmark --images 20 --annotations 20
+"""
+from billiard import Pool
+from config import Config
+from PIL import Image
+
+import imantics as im
+import numpy as np
+import argparse
+import tempfile
+import random
+import time
+import os
+
+from database import ImageModel, render_thumbnail
+
+
+RESOLUTIONS = {
+    '4K': (3840, 2160),
+    '12MP': (4000, 3000)
+}
+MAX_SIZE = (ImageModel.MAX_THUMBNAIL_DIM[1], ImageModel.MAX_THUMBNAIL_DIM[0])
+
+
+def random_polygon(width, height, points=12):
+    cx, cy = random.uniform(0, width), random.uniform(0, height)
+    radius = random.uniform(20, min(width, height) / 6)
+
+    polygon = []
+    for angle in sorted(random.uniform(0, 2 * np.pi) for _ in range(points)):
+        polygon.append(min(max(cx + radius * np.cos(angle), 0), width - 1))
+        polygon.append(min(max(cy + radius * np.sin(angle), 0), height - 1))
+    return polygon
+
+
+def seed(directory, resolution, num_images, num_annotations):
+    width, height = resolution
+    colors = ['#e6194b', '#3cb44b', '#4363d8', '#f58231']
+
+    jobs = []
+    for i in range(num_images):
+        path = os.path.join(directory, f'{i}.jpg')
+        noise = np.random.randint(0, 255, (height // 8, width // 8, 3), np.uint8)
+        Image.fromarray(noise).resize((width, height)).save(path, quality=90)
+
+        overlays = [
+            (random.choice(colors), [random_polygon(width, height)])
+            for _ in range(num_annotations)
+        ]
+        jobs.append((path, overlays))
+
+    return jobs
+
+
+def render_previous(job):
+    """ Previous path: imantics draws at full resolution, then downsizes """
+    path, overlays = job
+
+    image = im.Image.from_path(path)
+    for color, segmentation in overlays:
+        category = im.Category('category', color=im.Color(hex=color))
+        image.add(im.Annotation(image=image, category=category,
+                                polygons=segmentation, color=color))
+
+    pil_image = Image.fromarray(image.draw(color_by_category=True, bbox=False))
+    pil_image = pil_image.convert("RGB")
+    pil_image.thumbnail(MAX_SIZE)
+    pil_image.save(f"{path}.previous.thumbnail", "JPEG", quality=80,
+                   optimize=True, progressive=True)
+
+
+def render_engine(job):
+    path, overlays = job
+
+    pil_image = render_thumbnail(path, overlays, MAX_SIZE)
+    pil_image.save(f"{path}.thumbnail", "JPEG", quality=80,
+                   optimize=True, progressive=True)
+
+
+def measure(strategy, jobs, processes=None):
+    started_at = time.time()
+    if processes is None:
+        for job in jobs:
+            strategy(job)
+    else:
+        # Batches create their own pool, so starting it is timed too
+        with Pool(processes) as pool:
+            pool.map(strategy, jobs)
+    elapsed = time.time() - started_at
+
+    return len(jobs) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--images', type=int, default=20,
+                        help='Number of images per resolution')
+    parser.add_argument('--annotations', type=int, default=20,
+                        help='Number of annotations per image')
+    parser.add_argument('--processes', type=int, default=Config.THUMBNAIL_PROCESSES,
+                        help='Processes used by the pooled renderer')
+    args = parser.parse_args()
+
+    print(f"{'resolution':>10} {'strategy':>16} {'thumbnails/s':>13}")
+    for name, resolution in RESOLUTIONS.items():
+        with tempfile.TemporaryDirectory() as directory:
+            jobs = seed(directory, resolution, args.images, args.annotations)
+
+            results = [
+                ('previous', measure(render_previous, jobs)),
+                ('engine', measure(render_engine, jobs)),
+                (f'engine x{args.processes}',
+                 measure(render_engine, jobs, args.processes))
+            ]
+            for strategy, rate in results:
+                print(f"{name:>10} {strategy:>16} {rate:>13.1f}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
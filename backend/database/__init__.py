@@ -1,4 +1,6 @@
 from mongoengine import connect
+from mongoengine.connection import get_db
+from pymongo import ReturnDocument
 from config import Config
 
 from .annotations import *
@@ -41,6 +43,33 @@ def upsert(model, query=None, update=None):
     return new_model
 
 
+def reserve_ids(model, count):
+    """
+    Reserves a block of ids from the sequence of a model, for documents
+    inserted in bulk without going through SequenceField
+
+    :param model: model with a SequenceField primary key named id
+    :param count: number of ids to reserve
+    :return: range of the reserved ids
+    """
+    if count <= 0:
+        return range(0)
+
+    field = model._fields['id']
+    sequence_id = f"{field.get_sequence_name()}.{field.name}"
+    collection = get_db(alias=field.db_alias)[field.collection_name]
+
+    counter = collection.find_one_and_update(
+        filter={"_id": sequence_id},
+        update={"$inc": {"next": count}},
+        return_document=ReturnDocument.AFTER,
+        upsert=True
+    )
+    last = counter['next']
+
+    return range(last - count + 1, last + 1)
+
+
 def fix_ids(q):
     json_obj = json.loads(q.to_json().replace('\"_id\"', '\"id\"'))
     return json_obj
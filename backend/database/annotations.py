@@ -1,4 +1,5 @@
 import imantics as im
+import datetime
 import json
 
 from mongoengine import *
@@ -6,15 +7,26 @@ from mongoengine import *
 from .datasets import DatasetModel
 from .categories import CategoryModel
 from .events import Event
+from .tracked import TrackedDocument
 from flask_login import current_user
 
 
-class AnnotationModel(DynamicDocument):
+class AnnotationModel(TrackedDocument):
 
     COCO_PROPERTIES = ["id", "image_id", "category_id", "segmentation",
                        "iscrowd", "color", "area", "bbox", "metadata",
                        "keypoints", "isbbox"]
 
+    TRACKED_FIELDS = COCO_PROPERTIES + ["deleted"]
+
+    meta = {
+        'indexes': [
+            # Exports read annotations sorted by image
+            ('dataset_id', 'image_id', 'id'),
+            ('dataset_id', 'updated_at')
+        ]
+    }
+
     id = SequenceField(primary_key=True)
     image_id = IntField(required=True)
     category_id = IntField(required=True)
@@ -76,6 +88,14 @@ class AnnotationModel(DynamicDocument):
 
         return super(AnnotationModel, self).save(*args, **kwargs)
 
+    @classmethod
+    def _queryset_deleted(cls, queryset):
+        from .images import ImageModel
+
+        # Images of deleted annotations are read again by delta exports
+        ImageModel.objects(id__in=queryset.distinct('image_id')) \
+            .update(set__updated_at=datetime.datetime.utcnow())
+
     def is_empty(self):
         return len(self.segmentation) == 0 or self.area == 0
 
@@ -2,14 +2,18 @@
 from flask_login import current_user
 from mongoengine import *
 
+from .tracked import TrackedDocument
+
 import imantics as im
 
 
-class CategoryModel(DynamicDocument):
+class CategoryModel(TrackedDocument):
 
     COCO_PROPERTIES = ["id", "name", "supercategory", "color", "metadata",\
                        "keypoint_edges", "keypoint_labels", "keypoint_colors"]
 
+    TRACKED_FIELDS = COCO_PROPERTIES + ["deleted"]
+
     id = SequenceField(primary_key=True)
     name = StringField(required=True, unique_with=['creator'])
     supercategory = StringField(default='')
@@ -55,6 +59,13 @@ class CategoryModel(DynamicDocument):
       
         return super(CategoryModel, self).save(*args, **kwargs)
 
+    @classmethod
+    def _queryset_datasets(cls, queryset):
+        return {'categories__in': queryset.distinct('id')}
+
+    def _datasets(self):
+        return {'categories': self.id}
+
     def __call__(self):
         """ Generates imantics category object """
         data = {
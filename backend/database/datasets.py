@@ -23,6 +23,9 @@ class DatasetModel(DynamicDocument):
 
     default_annotation_metadata = DictField(default={})
 
+    #: Incremented on every annotation, image or category change
+    version = IntField(default=0)
+
     deleted = BooleanField(default=False)
     deleted_date = DateTimeField()
 
@@ -50,7 +53,13 @@ class DatasetModel(DynamicDocument):
         return UserModel.objects(username__in=members)\
             .exclude('password', 'id', 'preferences')
 
-    def import_coco(self, coco_json):
+    def import_coco(self, coco_path):
+        """
+        Imports a coco file saved on disk, the file is removed once the
+        import is done
+
+        :param coco_path: path of the coco file
+        """
 
         from workers.tasks import import_annotations
 
@@ -61,7 +70,7 @@ class DatasetModel(DynamicDocument):
         )
         task.save()
 
-        cel_task = import_annotations.delay(task.id, self.id, coco_json)
+        cel_task = import_annotations.delay(task.id, self.id, coco_path)
 
         return {
             "celery_id": cel_task.id,
@@ -69,13 +78,30 @@ class DatasetModel(DynamicDocument):
             "name": task.name
         }
 
-    def export_coco(self, categories=None, style="COCO"):
+    def export_coco(self, categories=None, style="COCO", shards=1, delta=False,
+                    mask_format="polygon"):
 
-        from workers.tasks import export_annotations
+        from workers.tasks import (
+            export_annotations,
+            export_annotations_delta,
+            export_annotations_sharded
+        )
 
         if categories is None or len(categories) == 0:
             categories = self.categories
 
+        if style == "PARQUET":
+            return self._export_parquet(categories)
+
+        cached = self.last_export(
+            categories, mask_format=mask_format, version=self.version)
+        if cached is not None:
+            return self._cached_export(cached, style)
+
+        base = None
+        if delta:
+            base = self.last_export(categories, mask_format=mask_format)
+
         task = TaskModel(
             name=f"Exporting {self.name} into {style} format",
             dataset_id=self.id,
@@ -83,7 +109,15 @@ class DatasetModel(DynamicDocument):
         )
         task.save()
 
-        cel_task = export_annotations.delay(task.id, self.id, categories)
+        if base is not None:
+            cel_task = export_annotations_delta.delay(
+                task.id, self.id, categories, base.id, mask_format)
+        elif shards > 1:
+            cel_task = export_annotations_sharded.delay(
+                task.id, self.id, categories, shards, mask_format)
+        else:
+            cel_task = export_annotations.delay(
+                task.id, self.id, categories, mask_format)
 
         return {
             "celery_id": cel_task.id,
@@ -91,7 +125,72 @@ class DatasetModel(DynamicDocument):
             "name": task.name
         }
 
-    def scan(self):
+    def _export_parquet(self, categories):
+
+        from workers.tasks import export_parquet
+
+        task = TaskModel(
+            name=f"Exporting {self.name} into PARQUET format",
+            dataset_id=self.id,
+            group="Annotation Export"
+        )
+        task.save()
+
+        cel_task = export_parquet.delay(task.id, self.id, categories)
+
+        return {
+            "celery_id": cel_task.id,
+            "id": task.id,
+            "name": task.name
+        }
+
+    def _cached_export(self, export, style):
+
+        task = TaskModel(
+            name=f"Exporting {self.name} into {style} format",
+            dataset_id=self.id,
+            group="Annotation Export",
+            completed=True,
+            progress=100
+        )
+        task.save()
+        task.info(f"Dataset has not changed since export {export.id}, reusing it")
+
+        return {
+            "celery_id": None,
+            "id": task.id,
+            "name": task.name,
+            "export_id": export.id
+        }
+
+    def last_export(self, categories, mask_format="polygon", version=None):
+        """
+        Returns the most recent export of the given categories which a delta
+        export can be built from
+
+        :param mask_format: format of the exported segmentation
+        :param version: only return exports of this dataset version
+        """
+        from .exports import ExportModel
+
+        exports = ExportModel.objects(
+            dataset_id=self.id,
+            categories=sorted(categories),
+            tags="COCO",
+            mask_format=mask_format,
+            snapshot_at__ne=None
+        ).order_by('-created_at')
+
+        if version is not None:
+            exports = exports.filter(dataset_version=version)
+
+        for export in exports:
+            if os.path.isfile(export.path):
+                return export
+
+        return None
+
+    def scan(self, full=False):
 
         from workers.tasks import scan_dataset
         
@@ -102,7 +201,26 @@ class DatasetModel(DynamicDocument):
         )
         task.save()
         
-        cel_task = scan_dataset.delay(task.id, self.id)
+        cel_task = scan_dataset.delay(task.id, self.id, full)
+
+        return {
+            "celery_id": cel_task.id,
+            "id": task.id,
+            "name": task.name
+        }
+
+    def reindex(self):
+
+        from workers.tasks import reindex_dataset
+
+        task = TaskModel(
+            name=f"Reindexing {self.name} counters",
+            dataset_id=self.id,
+            group="Dataset Reindex"
+        )
+        task.save()
+
+        cel_task = reindex_dataset.delay(task.id, self.id)
 
         return {
             "celery_id": cel_task.id,
@@ -2,9 +2,16 @@ from mongoengine import *
 
 import datetime
 import time
+import os
 
 
 class ExportModel(DynamicDocument):
+
+    #: File extension of every supported content encoding
+    ENCODINGS = {
+        'gzip': '.gz',
+        'zstd': '.zst'
+    }
     
     id = SequenceField(primary_key=True)
     dataset_id = IntField(required=True)
@@ -12,9 +19,81 @@ class ExportModel(DynamicDocument):
     tags = ListField(default=[])
     categories = ListField(default=[])
     created_at = DateTimeField(default=datetime.datetime.utcnow)
+
+    #: Time the export started reading the dataset
+    snapshot_at = DateTimeField()
+    #: Export a delta export was built from
+    base_id = IntField()
+    #: Dataset version the export was built from
+    dataset_version = IntField()
+    #: Format of annotation segmentation ("polygon" or "rle")
+    mask_format = StringField(default="polygon")
     
     def get_file(self):
         return
 
+    @property
+    def extension(self):
+        """ Extension of the file downloaded by clients """
+        return '.zip' if self.path.endswith('.zip') else '.json'
+
+    @property
+    def mimetype(self):
+        return 'application/zip' if self.extension == '.zip' \
+            else 'application/json'
+
+    @property
+    def encoding(self):
+        """ Content encoding of the export file (None if uncompressed) """
+        for encoding, extension in self.ENCODINGS.items():
+            if self.path.endswith(extension):
+                return encoding
+        return None
+
+    def delete(self, *args, **kwargs):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        return super(ExportModel, self).delete(*args, **kwargs)
+
+    @classmethod
+    def evict(cls, max_age, max_size):
+        """
+        Deletes cached exports older than max_age, and the oldest cached
+        exports once they take up more than max_size bytes. Cached exports
+        are older copies of an export of the same dataset, categories and
+        format. The newest of each is kept, so the latest export of every
+        dataset is never removed.
+
+        :param max_age: datetime.timedelta
+        :param max_size: total size in bytes of cached exports
+        :return: number of exports deleted
+        """
+        oldest = datetime.datetime.utcnow() - max_age
+
+        evicted = 0
+        total_size = 0
+        latest = set()
+        exports = cls.objects.only('id', 'dataset_id', 'path', 'tags',
+                                   'categories', 'mask_format', 'created_at')\
+            .order_by('-created_at')
+
+        for export in exports:
+            key = (export.dataset_id, tuple(export.tags),
+                   tuple(export.categories), export.mask_format)
+            if key not in latest:
+                latest.add(key)
+                continue
+
+            size = os.path.getsize(export.path) \
+                if os.path.isfile(export.path) else 0
+            total_size += size
+
+            if export.created_at < oldest or total_size > max_size:
+                export.delete()
+                total_size -= size
+                evicted += 1
+
+        return evicted
+
 
 __all__ = ["ExportModel"]
\ No newline at end of file
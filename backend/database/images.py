@@ -2,29 +2,152 @@ import os
 import imantics as im
 
 
-from PIL import Image, ImageFile
+from PIL import Image, ImageFile, ImageDraw
 from mongoengine import *
+from pymongo import UpdateOne
 
 from .events import Event, SessionEvent
 from .datasets import DatasetModel
 from .annotations import AnnotationModel
+from .categories import CategoryModel
+from .tracked import TrackedDocument
 
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 
-class ImageModel(DynamicDocument):
+def _hex_to_rgb(color):
+    color = (color or '#000000').lstrip('#')
+    try:
+        return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return (0, 0, 0)
+
+
+def render_thumbnail(path, overlays, max_size, alpha=0.5, thickness=3):
+    """
+    Renders a thumbnail with annotations drawn on top of it.
+
+    JPEGs are decoded at a reduced scale (draft mode) close to the thumbnail
+    size, and polygons are scaled down and drawn at thumbnail resolution,
+    so the full resolution image is never decoded or drawn on.
+
+    :param path: path of the image
+    :param overlays: list of (color, segmentation) to draw
+    :param max_size: (width, height) the thumbnail must fit in
+    :param alpha: opacity of the filled polygons
+    :param thickness: width of outlines in full resolution pixels
+    :return: RGB PIL image
+    """
+    image = Image.open(path)
+    width, height = image.size
+
+    image.draft('RGB', max_size)
+    image = image.convert('RGB')
+    image.thumbnail(max_size, Image.LANCZOS)
+
+    if len(overlays) == 0:
+        return image
+
+    scale_x = image.width / width
+    scale_y = image.height / height
+    line_width = max(int(round(thickness * scale_x)), 1)
+
+    fill = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    lines = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    fill_draw = ImageDraw.Draw(fill)
+    lines_draw = ImageDraw.Draw(lines)
+
+    for color, segmentation in overlays:
+        rgb = _hex_to_rgb(color)
+        for polygon in segmentation:
+            points = [(x * scale_x, y * scale_y)
+                      for x, y in zip(polygon[0::2], polygon[1::2])]
+            if len(points) < 3:
+                continue
+
+            fill_draw.polygon(points, fill=rgb + (int(255 * alpha),))
+            lines_draw.line(points + points[:1], fill=rgb + (255,),
+                            width=line_width)
+
+    image = image.convert('RGBA')
+    image.alpha_composite(fill)
+    image.alpha_composite(lines)
+
+    return image.convert('RGB')
+
+
+def save_thumbnails(pil_image, paths):
+    """
+    Saves a thumbnail at several sizes, each downsized from the largest
+
+    :param pil_image: thumbnail rendered at the largest size
+    :param paths: dictionary of size to path
+    """
+    for size in sorted(paths, reverse=True):
+        pil_image = pil_image.copy()
+        pil_image.thumbnail((size, size), Image.LANCZOS)
+        os.makedirs(os.path.dirname(paths[size]), exist_ok=True)
+        # Save as a jpeg to improve loading time
+        # (note file extension will not match but allows for backwards compatibility)
+        pil_image.save(paths[size], "JPEG", quality=80, optimize=True, progressive=True)
+
+
+def thumbnail_overlays(image_ids):
+    """
+    Loads the polygons drawn on the thumbnails of images, colored by
+    category, with one query for annotations and one for categories
+
+    :param image_ids: ids of the images
+    :return: dictionary of image id to list of (color, segmentation)
+    """
+    annotations = AnnotationModel.objects(
+        image_id__in=list(image_ids), deleted=False, area__gt=0
+    ).only('image_id', 'category_id', 'segmentation').as_pymongo()
+    annotations = list(annotations)
+
+    category_ids = {a.get('category_id') for a in annotations}
+    colors = {
+        category.id: category.color
+        for category in CategoryModel.objects(id__in=list(category_ids))
+        .only('id', 'color')
+    }
+
+    overlays = {image_id: [] for image_id in image_ids}
+    for annotation in annotations:
+        segmentation = annotation.get('segmentation') or []
+        if len(segmentation) == 0:
+            continue
+
+        color = colors.get(annotation.get('category_id'))
+        overlays[annotation['image_id']].append((color, segmentation))
+
+    return overlays
+
+
+class ImageModel(TrackedDocument):
 
     COCO_PROPERTIES = ["id", "width", "height", "file_name", "path", "license",\
                        "flickr_url", "coco_url", "date_captured", "dataset_id",\
                        "uploaded_by"]
 
+    TRACKED_FIELDS = COCO_PROPERTIES + ["deleted"]
+
+    meta = {
+        'indexes': [
+            ('dataset_id', 'updated_at')
+        ]
+    }
+
     # -- Contants
     THUMBNAIL_DIRECTORY = '.thumbnail'
+    TILES_DIRECTORY = '.tiles'
     PATTERN = (".gif", ".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".GIF", ".PNG", ".JPG", ".JPEG", ".BMP", ".TIF", ".TIFF")
 
     # Set maximum thumbnail size (h x w) to use on dataset page
     MAX_THUMBNAIL_DIM = (1024, 1024)
+    # Sizes thumbnails are stored at, the largest is MAX_THUMBNAIL_DIM
+    THUMBNAIL_SIZES = (128, 256, 512, 1024)
 
     # -- Private
     _dataset = None
@@ -101,8 +224,72 @@ class ImageModel(DynamicDocument):
 
         return image
 
+    @classmethod
+    def reindex_counters(cls, dataset_id):
+        """
+        Recomputes num_annotations, annotated and category_ids of every image
+        in a dataset with one aggregation, and writes the images that changed
+        with one bulk write. Categories of annotations are added to
+        category_ids, categories without annotations are kept.
+
+        :param dataset_id: id of the dataset
+        :return: number of images updated
+        """
+        counters = AnnotationModel._get_collection().aggregate([
+            {'$match': {
+                'dataset_id': dataset_id,
+                'deleted': False,
+                '$or': [
+                    {'area': {'$gt': 0}},
+                    {'keypoints.0': {'$exists': True}}
+                ]
+            }},
+            {'$group': {
+                '_id': '$image_id',
+                'count': {'$sum': 1},
+                'category_ids': {'$addToSet': '$category_id'}
+            }}
+        ])
+        counters = {row['_id']: row for row in counters}
+
+        images = cls._get_collection().find(
+            {'dataset_id': dataset_id},
+            {'num_annotations': 1, 'annotated': 1, 'category_ids': 1}
+        )
+
+        requests = []
+        for image in images:
+            counter = counters.get(image['_id'], {})
+            num_annotations = counter.get('count', 0)
+
+            category_ids = image.get('category_ids') or []
+            missing = [c for c in counter.get('category_ids', [])
+                       if c not in category_ids]
+
+            if num_annotations == image.get('num_annotations') and \
+                    (num_annotations > 0) == image.get('annotated') and \
+                    len(missing) == 0:
+                continue
+
+            requests.append(UpdateOne({'_id': image['_id']}, {'$set': {
+                'num_annotations': num_annotations,
+                'annotated': num_annotations > 0,
+                'category_ids': category_ids + missing
+            }}))
+
+        if len(requests) > 0:
+            cls._get_collection().bulk_write(requests, ordered=False)
+
+        return len(requests)
+
+    @classmethod
+    def _queryset_deleted(cls, queryset):
+        # Annotations are removed with their images, as delete() does
+        AnnotationModel.objects(image_id__in=queryset.distinct('id')).delete()
+
     def delete(self, *args, **kwargs):
         self.thumbnail_delete()
+        self.tiles_delete()
         AnnotationModel.objects(image_id=self.id).delete()
         return super(ImageModel, self).delete(*args, **kwargs)
 
@@ -110,20 +297,15 @@ class ImageModel(DynamicDocument):
         """
         Generates (if required) thumbnail
         """
-        
-        thumbnail_path = self.thumbnail_path()
 
         if self.regenerate_thumbnail:
 
-            pil_image = self.generate_thumbnail()
-            pil_image = pil_image.convert("RGB")
-
+            overlays = thumbnail_overlays([self.id])[self.id]
             # Resize image to fit in MAX_THUMBNAIL_DIM envelope as necessary
-            pil_image.thumbnail((self.MAX_THUMBNAIL_DIM[1], self.MAX_THUMBNAIL_DIM[0]))
+            max_size = (self.MAX_THUMBNAIL_DIM[1], self.MAX_THUMBNAIL_DIM[0])
+            pil_image = render_thumbnail(self.path, overlays, max_size)
 
-            # Save as a jpeg to improve loading time
-            # (note file extension will not match but allows for backwards compatibility)
-            pil_image.save(thumbnail_path, "JPEG", quality=80, optimize=True, progressive=True)
+            save_thumbnails(pil_image, self.thumbnail_paths())
 
             self.update(is_modified=False)
             return pil_image
@@ -135,26 +317,56 @@ class ImageModel(DynamicDocument):
         thumbnail_path = self.thumbnail_path()
         return Image.open(thumbnail_path)
 
-    def thumbnail_path(self):
+    def thumbnail_path(self, size=None):
+        """
+        Returns the path of the thumbnail at one of THUMBNAIL_SIZES, the
+        largest size is stored directly in the thumbnail directory
+        """
         folders = self.path.split('/')
         folders.insert(len(folders)-1, self.THUMBNAIL_DIRECTORY)
+        if size is not None and size != max(self.THUMBNAIL_SIZES):
+            folders.insert(len(folders)-1, str(size))
 
-        path = '/' + os.path.join(*folders)
-        directory = os.path.dirname(path)
-
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        
-        return path
+        return '/' + os.path.join(*folders)
     
+    def thumbnail_paths(self):
+        return {size: self.thumbnail_path(size) for size in self.THUMBNAIL_SIZES}
+
+    def thumbnail_size(self, width, height):
+        """
+        Returns the smallest thumbnail size which covers an image fitted in
+        width x height, or the largest size if none does
+        """
+        if not self.width or not self.height:
+            return max(self.THUMBNAIL_SIZES)
+
+        scale = min(width / self.width, height / self.height, 1)
+        longest = scale * max(self.width, self.height)
+
+        for size in sorted(self.THUMBNAIL_SIZES):
+            if size >= longest:
+                return size
+        return max(self.THUMBNAIL_SIZES)
+
     def thumbnail_delete(self):
-        path = self.thumbnail_path()
-        if os.path.isfile(path):
-            os.remove(path)
+        for path in self.thumbnail_paths().values():
+            # Copies in other formats are stored next to the thumbnail
+            for path in (path, f"{path}.webp", f"{path}.avif"):
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def tiles_path(self):
+        """
+        Returns the path of the pack file of the image's deep zoom tiles
+        """
+        directory, file_name = os.path.split(self.path)
+        return os.path.join(directory, self.TILES_DIRECTORY, f"{file_name}.tiles")
 
-    def generate_thumbnail(self):
-        image = self().draw(color_by_category=True, bbox=False)
-        return Image.fromarray(image)
+    def tiles_delete(self):
+        path = self.tiles_path()
+        for path in (path, f"{path}.pending"):
+            if os.path.isfile(path):
+                os.remove(path)
 
     def flag_thumbnail(self, flag=True):
         """
@@ -221,4 +433,5 @@ class ImageModel(DynamicDocument):
         self.update(**u)
 
 
-__all__ = ["ImageModel"]
+__all__ = ["ImageModel", "render_thumbnail", "save_thumbnails",
+           "thumbnail_overlays"]
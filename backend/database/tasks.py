@@ -1,6 +1,43 @@
 from mongoengine import *
+from mongoengine.errors import NotUniqueError
+from config import Config
 
 import datetime
+import time
+
+
+# Tasks with log lines which have not been written yet. References are
+# strong, so lines are still written after the task function returned.
+_unflushed_tasks = {}
+
+
+def flush_task_logs():
+    """
+    Writes the buffered log lines of every task in this process
+    """
+    for task in list(_unflushed_tasks.values()):
+        task.flush_logs()
+
+
+class TaskLogModel(DynamicDocument):
+    """
+    Page of log lines of a task. Lines are stored apart from TaskModel, so
+    task documents stay small no matter how much a task logs.
+    """
+
+    meta = {
+        'indexes': [
+            {'fields': ('task_id', 'offset'), 'unique': True}
+        ]
+    }
+
+    task_id = IntField(required=True)
+
+    # Position of the first line in the log, and of the line after the last
+    offset = IntField(required=True)
+    end = IntField(required=True)
+
+    lines = ListField(default=[])
 
 
 class TaskModel(DynamicDocument):
@@ -29,7 +66,9 @@ class TaskModel(DynamicDocument):
 
     progress = FloatField(default=0, min_value=0, max_value=100)
 
+    # Logs of older tasks, new lines are written to TaskLogModel
     logs = ListField(default=[])
+    log_count = IntField(default=0)
     errors = IntField(default=0)
     warnings = IntField(default=0)
 
@@ -37,8 +76,14 @@ class TaskModel(DynamicDocument):
 
     metadata = DictField(default={})
 
-    _update_every = 10
-    _progress_update = 0
+    # (percent, time) of the last progress written to the database
+    _progress_written = None
+    _shard_progress_written = None
+
+    _log_buffer = None
+    _log_errors = 0
+    _log_warnings = 0
+    _log_flushed_at = 0
 
     def error(self, string):
         self._log(string, level="ERROR")
@@ -56,39 +101,182 @@ class TaskModel(DynamicDocument):
         
         message = f"[{date}] [{level}] {string}"
 
-        statment = {
-            'push__logs': message
-        }
+        if self._log_buffer is None:
+            self._log_buffer = []
+
+        self._log_buffer.append(message)
+        _unflushed_tasks[id(self)] = self
 
         if level == "ERROR":
-            statment['inc__errors'] = 1
+            self._log_errors += 1
             self.errors += 1
         
         if level == "WARNING":
-            statment['inc__warnings'] = 1
+            self._log_warnings += 1
             self.warnings += 1
 
-        self.update(**statment)
+        # Lines are written in batches to avoid one update per line
+        if len(self._log_buffer) >= Config.TASK_LOG_BUFFER_SIZE or \
+                time.time() - self._log_flushed_at >= Config.TASK_LOG_FLUSH_INTERVAL:
+            self.flush_logs()
+
+    def flush_logs(self):
+        """
+        Writes buffered log lines as a new page of the task's log
+        """
+        lines = self._log_buffer
+        _unflushed_tasks.pop(id(self), None)
+
+        if not lines:
+            return
+
+        statment = {'inc__log_count': len(lines)}
+        if self._log_errors > 0:
+            statment['inc__errors'] = self._log_errors
+        if self._log_warnings > 0:
+            statment['inc__warnings'] = self._log_warnings
+
+        self._log_buffer = []
+        self._log_errors = 0
+        self._log_warnings = 0
+        self._log_flushed_at = time.time()
+
+        # Pages are appended after the last page of the log. Other processes
+        # can log to the same task, the page is then moved after theirs.
+        # Positions only exist once their page is written, so readers never
+        # wait on a page which is not written yet.
+        while True:
+            last = self._last_log_page()
+            offset = last.end if last is not None else 0
+            try:
+                TaskLogModel(
+                    task_id=self.id,
+                    offset=offset,
+                    end=offset + len(lines),
+                    lines=lines
+                ).save(force_insert=True)
+                break
+            except NotUniqueError:
+                continue
+
+        TaskModel.objects(id=self.id).update(**statment)
+        self.log_count = offset + len(lines)
+
+    def read_logs(self, cursor=0, limit=1000):
+        """
+        Returns the log lines written after cursor
+
+        :param cursor: position of the first line to return
+        :param limit: maximum number of lines to return
+        :return: lines, position of the next line, and True if more lines
+            were written after them
+        """
+        if self._last_log_page() is None:
+            # Older tasks keep their logs in the task document
+            task = TaskModel.objects(id=self.id) \
+                .fields(slice__logs=[cursor, limit + 1]).first()
+            lines = task.logs[:limit]
+            return lines, cursor + len(lines), len(task.logs) > limit
+
+        lines = []
+        pages = TaskLogModel.objects(task_id=self.id, end__gt=cursor) \
+            .order_by('offset').no_cache()
+
+        for page in pages:
+            # Pages are only written at the end of the log, nothing is ever
+            # written before a page once it exists
+            cursor = max(cursor, page.offset)
+
+            start = cursor - page.offset
+            page_lines = page.lines[start:start + limit - len(lines)]
+            lines.extend(page_lines)
+            cursor += len(page_lines)
+
+            if len(lines) >= limit:
+                break
+
+        more = TaskLogModel.objects(task_id=self.id, end__gt=cursor) \
+            .only('id').first() is not None
+
+        return lines, cursor, more
+
+    def log_length(self):
+        """
+        Returns the number of lines in the task's log
+        """
+        last = self._last_log_page()
+        if last is not None:
+            return last.end
+
+        # Older tasks keep their logs in the task document
+        length = TaskModel._get_collection().aggregate([
+            {'$match': {'_id': self.id}},
+            {'$project': {'length': {'$size': {'$ifNull': ['$logs', []]}}}}
+        ])
+        return next(length, {}).get('length', 0)
+
+    def _last_log_page(self):
+        return TaskLogModel.objects(task_id=self.id).order_by('-offset') \
+            .only('end').first()
+
+    def delete(self, *args, **kwargs):
+        TaskLogModel.objects(task_id=self.id).delete()
+        return super(TaskModel, self).delete(*args, **kwargs)
+
+    @staticmethod
+    def _progress_due(written, percent):
+        """
+        Returns True if progress has moved by TASK_PROGRESS_STEP or
+        TASK_PROGRESS_INTERVAL seconds have passed since it was last written
+        """
+        if written is None or percent >= 100:
+            return True
+
+        last_percent, last_time = written
+        return abs(percent - last_percent) >= Config.TASK_PROGRESS_STEP or \
+            time.time() - last_time >= Config.TASK_PROGRESS_INTERVAL
 
     def set_progress(self, percent, socket=None):
 
+        # Progress is kept in memory until it is worth writing
+        if not self._progress_due(self._progress_written, percent):
+            return
+
+        self._progress_written = (percent, time.time())
+
+        if percent >= 100:
+            self.flush_logs()
+
         self.update(progress=int(percent), completed=(percent >= 100))
 
-        # Send socket update every 10%
-        if self._progress_update < percent or percent >= 100:
-            
-            if socket is not None:
-                # logger.debug(f"Emitting {percent} progress update for task {self.id}")
-
-                socket.emit('taskProgress', {
-                    'id': self.id,
-                    'progress': percent,
-                    'errors': self.errors,
-                    'warnings': self.warnings
-                }, broadcast=True)
-            
-            self._progress_update += self._update_every
+        if socket is not None:
+            # logger.debug(f"Emitting {percent} progress update for task {self.id}")
+
+            socket.emit('taskProgress', {
+                'id': self.id,
+                'progress': percent,
+                'errors': self.errors,
+                'warnings': self.warnings
+            }, broadcast=True)
     
+    def set_shard_progress(self, shard, percent, socket=None):
+        """
+        Records the progress of one shard and updates the task progress
+        with the combined progress of all shards. The combined progress
+        stops short of 100 so the merge step can complete the task.
+        """
+        if not self._progress_due(self._shard_progress_written, percent):
+            return
+
+        self._shard_progress_written = (percent, time.time())
+        self.modify(**{f'set__metadata__shards__{shard}': percent})
+
+        shards = self.metadata.get('shards', {})
+        num_shards = max(self.metadata.get('num_shards', len(shards)), 1)
+        combined = sum(shards.values()) / num_shards
+
+        self.set_progress(min(combined, 99), socket=socket)
+
     def api_json(self):
         return {
             "id": self.id,
@@ -96,4 +284,4 @@ class TaskModel(DynamicDocument):
         }
 
 
-__all__ = ["TaskModel"]
\ No newline at end of file
+__all__ = ["TaskModel", "TaskLogModel", "flush_task_logs"]
\ No newline at end of file
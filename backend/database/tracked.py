@@ -0,0 +1,199 @@
+from mongoengine import *
+from mongoengine.queryset import transform
+from pymongo import UpdateOne
+
+import datetime
+
+
+def _updated_fields(document, update):
+    """
+    Returns the top level fields modified by a mongoengine style update
+    (e.g. set__metadata__name=... modifies metadata)
+    """
+    fields = set()
+    for key in update:
+        parts = key.split('__')
+        # Updates without an operator set the field (e.g. name=...)
+        if len(parts) > 1 and parts[0] in transform.UPDATE_OPERATORS:
+            fields.add(parts[1])
+        else:
+            fields.add(parts[0])
+    return fields
+
+
+def _stamp(document, update):
+    """
+    Adds a new updated_at value to an update if it touches a tracked field
+
+    :return: True if the update was stamped
+    """
+    if 'set__updated_at' in update or 'updated_at' in update:
+        return False
+
+    tracked = document.TRACKED_FIELDS
+    if _updated_fields(document, update).isdisjoint(tracked):
+        return False
+
+    update['set__updated_at'] = datetime.datetime.utcnow()
+    return True
+
+
+def _bump_datasets(query):
+    """
+    Increments the content version of all datasets matching the query
+    """
+    from .datasets import DatasetModel
+    DatasetModel.objects(**query).update(inc__version=1)
+
+
+class TrackedQuerySet(QuerySet):
+    """
+    QuerySet which records the modification time of documents updated
+    through it and bumps the version of the datasets they belong to
+    """
+
+    def update(self, *args, **update):
+        if not _stamp(self._document, update):
+            return super(TrackedQuerySet, self).update(*args, **update)
+
+        # Datasets are found before updating as the update could change
+        # which documents the query matches
+        datasets = self._document._queryset_datasets(self)
+        result = super(TrackedQuerySet, self).update(*args, **update)
+        _bump_datasets(datasets)
+
+        return result
+
+    def modify(self, *args, **update):
+        if not _stamp(self._document, update):
+            return super(TrackedQuerySet, self).modify(*args, **update)
+
+        datasets = self._document._queryset_datasets(self)
+        result = super(TrackedQuerySet, self).modify(*args, **update)
+        _bump_datasets(datasets)
+
+        return result
+
+    def delete(self, *args, **kwargs):
+        # Deleted documents leave no updated_at behind, so the datasets
+        # are bumped and dependent documents are stamped instead
+        datasets = self._document._queryset_datasets(self)
+        self._document._queryset_deleted(self)
+
+        result = super(TrackedQuerySet, self).delete(*args, **kwargs)
+        if result:
+            _bump_datasets(datasets)
+
+        return result
+
+
+class TrackedDocument(DynamicDocument):
+    """
+    Document which keeps an updated_at timestamp of the last time any of
+    its TRACKED_FIELDS changed, and bumps the content version of the
+    datasets it belongs to. Used to find documents modified since a
+    previous export.
+    """
+
+    TRACKED_FIELDS = []
+
+    meta = {
+        'abstract': True,
+        'queryset_class': TrackedQuerySet
+    }
+
+    updated_at = DateTimeField()
+
+    @classmethod
+    def _queryset_datasets(cls, queryset):
+        """
+        Returns a DatasetModel query matching the datasets of the documents
+        in the queryset
+        """
+        dataset_id = queryset._query.get('dataset_id')
+        if isinstance(dataset_id, int):
+            return {'id': dataset_id}
+
+        return {'id__in': queryset.distinct('dataset_id')}
+
+    def _datasets(self):
+        """
+        Returns a DatasetModel query matching the datasets of this document
+        """
+        return {'id': self.dataset_id}
+
+    @classmethod
+    def _queryset_deleted(cls, queryset):
+        """
+        Called before the documents in the queryset are deleted
+        """
+        pass
+
+    @classmethod
+    def bulk_update(cls, updates):
+        """
+        Applies mongoengine style updates to many documents with one bulk
+        write. Updates of tracked fields are stamped, and the datasets of
+        the stamped documents are bumped once.
+
+        :param updates: dictionary of document id to update
+            (e.g. {1: {'set__color': '#ffffff'}})
+        :return: number of documents matched
+        """
+        if len(updates) == 0:
+            return 0
+
+        requests = []
+        stamped = []
+        for document_id, update in updates.items():
+            update = dict(update)
+            if _stamp(cls, update):
+                stamped.append(document_id)
+
+            requests.append(UpdateOne(
+                {'_id': document_id}, transform.update(cls, **update)))
+
+        datasets = None
+        if len(stamped) > 0:
+            datasets = cls._queryset_datasets(cls.objects(id__in=stamped))
+
+        result = cls._get_collection().bulk_write(requests, ordered=False)
+
+        if datasets is not None:
+            _bump_datasets(datasets)
+
+        return result.matched_count
+
+    def save(self, *args, **kwargs):
+
+        changed = {field.split('.')[0] for field in self._get_changed_fields()}
+        stamped = self._created or not changed.isdisjoint(self.TRACKED_FIELDS)
+        if stamped:
+            self.updated_at = datetime.datetime.utcnow()
+
+        result = super(TrackedDocument, self).save(*args, **kwargs)
+        if stamped:
+            _bump_datasets(self._datasets())
+
+        return result
+
+    def update(self, **kwargs):
+        if not _stamp(self, kwargs):
+            return super(TrackedDocument, self).update(**kwargs)
+
+        result = super(TrackedDocument, self).update(**kwargs)
+        _bump_datasets(self._datasets())
+
+        return result
+
+    def modify(self, query=None, **update):
+        if not _stamp(self, update):
+            return super(TrackedDocument, self).modify(query, **update)
+
+        result = super(TrackedDocument, self).modify(query, **update)
+        _bump_datasets(self._datasets())
+
+        return result
+
+
+__all__ = ["TrackedDocument", "TrackedQuerySet"]
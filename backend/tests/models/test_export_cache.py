@@ -0,0 +1,44 @@
+from database import (
+    AnnotationModel,
+    CategoryModel,
+    DatasetModel,
+    ExportModel,
+    ImageModel
+)
+
+
+class TestExportCache:
+
+    @classmethod
+    def setup_class(cls):
+        DatasetModel.objects(name="Export Cache").delete()
+
+    def test_hard_delete_invalidates_cache(self, tmpdir):
+        dataset = DatasetModel(name="Export Cache")
+        dataset.save()
+
+        category = CategoryModel(name="Export Cache Category")
+        category.save()
+        dataset.update(categories=[category.id])
+
+        image = ImageModel(dataset_id=dataset.id, path=str(tmpdir.join("a.jpg")),
+                           file_name="a.jpg", width=10, height=10)
+        image.save()
+        AnnotationModel(image_id=image.id, category_id=category.id,
+                        segmentation=[[1, 1, 5, 1, 5, 5]]).save()
+
+        dataset.reload()
+        path = str(tmpdir.join("export.json"))
+        open(path, 'w').close()
+        ExportModel(dataset_id=dataset.id, path=path, tags=["COCO"],
+                    categories=[category.id], snapshot_at=image.updated_at,
+                    dataset_version=dataset.version).save()
+
+        assert dataset.last_export([category.id], version=dataset.version) \
+            is not None
+
+        ImageModel.objects(id=image.id).delete()
+        dataset.reload()
+
+        assert dataset.last_export([category.id], version=dataset.version) is None
+        assert AnnotationModel.objects(image_id=image.id).count() == 0
@@ -0,0 +1,133 @@
+import json
+
+from workers.export_util import (
+    CocoWriter,
+    CocoPartWriter,
+    RLEEncoder,
+    format_annotation,
+    iter_export_records,
+    open_export
+)
+
+
+class TestCocoWriter:
+
+    def test_write_sections(self, tmpdir):
+        path = str(tmpdir.join("coco.json"))
+
+        with CocoWriter(path) as writer:
+            writer.write_category({"id": 1, "name": "cat"})
+            writer.write_image({"id": 1, "file_name": "a.jpg"})
+            writer.write_image({"id": 2, "file_name": "b.jpg"})
+            writer.write_annotation({"id": 1, "image_id": 2})
+
+        with open(path) as fp:
+            coco = json.load(fp)
+
+        assert [i['id'] for i in coco['images']] == [1, 2]
+        assert coco['categories'][0]['name'] == "cat"
+        assert coco['annotations'][0]['image_id'] == 2
+
+    def test_write_empty(self, tmpdir):
+        path = str(tmpdir.join("coco.json"))
+
+        with CocoWriter(path):
+            pass
+
+        with open(path) as fp:
+            coco = json.load(fp)
+
+        assert coco == {'images': [], 'categories': [], 'annotations': []}
+
+    def test_append_parts(self, tmpdir):
+        directory = str(tmpdir)
+
+        for shard, image_ids in enumerate([[1, 2], [], [3]]):
+            with CocoPartWriter(directory, shard) as part:
+                for image_id in image_ids:
+                    part.write_image({"id": image_id})
+
+        path = str(tmpdir.join("coco.json"))
+        with CocoWriter(path) as writer:
+            for shard, count in enumerate([2, 0, 1]):
+                part_path = CocoPartWriter.part_path(directory, shard, 'images')
+                writer.append_part('images', part_path, count)
+
+            assert writer.count('images') == 3
+
+        with open(path) as fp:
+            coco = json.load(fp)
+
+        assert [i['id'] for i in coco['images']] == [1, 2, 3]
+
+    def test_read_records(self, tmpdir):
+        path = str(tmpdir.join("coco.json"))
+
+        with CocoWriter(path) as writer:
+            writer.write_image({"id": 1, "file_name": "a,[b].jpg"})
+            writer.write_image({"id": 2})
+            writer.write_annotation({"id": 3, "image_id": 2})
+
+        with open(path) as fp:
+            records = [(section, json.loads(record))
+                       for section, record in iter_export_records(fp)]
+
+        assert records == [
+            ('images', {"id": 1, "file_name": "a,[b].jpg"}),
+            ('images', {"id": 2}),
+            ('annotations', {"id": 3, "image_id": 2})
+        ]
+
+    def test_write_compressed(self, tmpdir):
+        path = str(tmpdir.join("coco.json.gz"))
+
+        with CocoWriter(path, encoding='gzip') as writer:
+            writer.write_image({"id": 1})
+
+        with open(path, 'rb') as fp:
+            assert fp.read(2) == b'\x1f\x8b'
+
+        with open_export(path, 'r', 'gzip') as fp:
+            coco = json.load(fp)
+
+        assert coco['images'] == [{"id": 1}]
+
+
+class TestFormatAnnotation:
+
+    def test_empty_annotation(self):
+        assert format_annotation({"segmentation": [], "keypoints": []}) is None
+
+    def test_num_keypoints(self):
+        annotation = format_annotation({"keypoints": [1, 1, 2, 0, 0, 0]})
+        assert annotation['num_keypoints'] == 1
+
+
+class TestRLEEncoder:
+
+    def test_encode(self):
+        image = {"id": 1, "width": 20, "height": 10}
+        annotation = {"id": 1, "segmentation": [[1, 1, 8, 1, 8, 8, 1, 8]]}
+
+        encoder = RLEEncoder(processes=1)
+        failed = encoder.encode([(image, [annotation])])
+        encoder.close()
+
+        assert failed == []
+        assert annotation['segmentation']['size'] == [10, 20]
+        assert isinstance(annotation['segmentation']['counts'], str)
+        assert encoder.count == 1
+
+    def test_invalid_polygons_are_kept(self):
+        image = {"id": 1, "width": 20, "height": 10}
+        valid = {"id": 1, "segmentation": [[1, 1, 8, 1, 8, 8]]}
+        empty = {"id": 2, "segmentation": [[]]}
+        short = {"id": 3, "segmentation": [[1, 1, 8, 1]]}
+
+        encoder = RLEEncoder(processes=1)
+        failed = encoder.encode([(image, [valid, empty, short])])
+        encoder.close()
+
+        assert [annotation['id'] for annotation, _ in failed] == [2, 3]
+        assert short['segmentation'] == [[1, 1, 8, 1]]
+        assert 'counts' in valid['segmentation']
@@ -0,0 +1,90 @@
+import io
+import json
+
+import pytest
+
+from workers.import_util import (
+    ChunkWriter,
+    annotation_key,
+    iter_coco_sections,
+    read_chunk
+)
+
+
+def _sections(coco, sections, chunk_size=7):
+    fp = io.BytesIO(json.dumps(coco, indent=2).encode('utf-8'))
+    return list(iter_coco_sections(fp, sections, chunk_size))
+
+
+class TestIterCocoSections:
+
+    def test_reads_sections(self):
+        coco = {
+            "info": {"year": 2019, "nested": [[1, 2], {"a": "]}"}]},
+            "annotations": [{"id": 1, "image_id": 2}, {"id": 2, "image_id": 2}],
+            "images": [{"id": 2, "file_name": "é.jpg"}],
+            "categories": [],
+            "version": 12345
+        }
+
+        items = _sections(coco, ("images", "annotations"))
+
+        assert items == [
+            ("annotations", {"id": 1, "image_id": 2}),
+            ("annotations", {"id": 2, "image_id": 2}),
+            ("images", {"id": 2, "file_name": "é.jpg"})
+        ]
+
+    def test_skips_sections(self):
+        coco = {"images": [{"id": 1}], "categories": [{"id": 3}]}
+        assert _sections(coco, ("categories",)) == [("categories", {"id": 3})]
+
+    def test_empty_file(self):
+        assert _sections({}, ("images",)) == []
+
+    def test_invalid_file(self):
+        fp = io.BytesIO(b'{"images": [{"id": 1,}]}')
+        with pytest.raises(ValueError):
+            list(iter_coco_sections(fp, ("images",)))
+
+
+
+class TestAnnotationKey:
+
+    def test_integer_and_float_coordinates(self):
+        a = annotation_key(1, 2, [[1, 1, 10, 1, 10, 10]], [])
+        b = annotation_key(1, 2, [[1.0, 1.0, 10.0, 1, 10, 10.0]], [])
+        assert a == b
+
+    def test_missing_keypoints(self):
+        a = annotation_key(1, 2, [[1, 1, 10, 1, 10, 10]], None)
+        b = annotation_key(1, 2, [[1, 1, 10, 1, 10, 10]], [])
+        assert a == b
+
+    def test_different_annotations(self):
+        segmentation = [[1, 1, 10, 1, 10, 10]]
+        key = annotation_key(1, 2, segmentation, [])
+
+        assert key != annotation_key(3, 2, segmentation, [])
+        assert key != annotation_key(1, 3, segmentation, [])
+        assert key != annotation_key(1, 2, [[1, 1, 10, 1, 10, 11]], [])
+        assert key != annotation_key(1, 2, segmentation, [5, 5, 2])
+
+
+class TestChunkWriter:
+
+    def test_chunks_by_image(self, tmpdir):
+        directory = str(tmpdir)
+        images = [{"id": i, "width": 10, "height": 10} for i in range(3)]
+
+        writer = ChunkWriter(directory, chunk_size=2, buffer_size=1)
+        for i in range(6):
+            writer.write(images[i % 3], 1, {"id": i})
+        writer.close()
+
+        assert writer.chunks == 2
+
+        chunks = [read_chunk(directory, chunk) for chunk in range(2)]
+        assert [[a["id"] for _, _, a in chunk] for chunk in chunks] == \
+            [[0, 1, 3, 4], [2, 5]]
+        assert chunks[1][0] == [images[2], 1, {"id": 2}]
@@ -0,0 +1,99 @@
+import os
+
+from PIL import Image
+from workers.scan_util import ScanManifest, probe_image
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+
+
+def _scan(directory, full=False):
+    manifest = ScanManifest(directory).load()
+    paths = sorted(os.path.relpath(path, directory)
+                   for path, _ in manifest.walk(full=full))
+    manifest.save()
+    return paths, manifest
+
+
+class TestScanManifest:
+
+    def test_walk(self, tmpdir):
+        directory = str(tmpdir)
+        _touch(os.path.join(directory, "a.jpg"))
+        _touch(os.path.join(directory, "notes.txt"))
+        _touch(os.path.join(directory, "sub", "b.png"))
+        _touch(os.path.join(directory, ".thumbnail", "a.jpg"))
+
+        paths, manifest = _scan(directory)
+
+        assert paths == ["a.jpg", "sub/b.png"]
+        assert manifest.listed == 2
+
+    def test_skips_unchanged_directories(self, tmpdir):
+        directory = str(tmpdir)
+        _touch(os.path.join(directory, "sub", "deep", "a.jpg"))
+        _scan(directory)
+        _scan(directory)
+
+        _touch(os.path.join(directory, "sub", "deep", "b.jpg"))
+        paths, manifest = _scan(directory)
+
+        assert paths == ["sub/deep/a.jpg", "sub/deep/b.jpg"]
+        assert manifest.listed == 1
+        assert manifest.visited == 3
+
+    def test_full(self, tmpdir):
+        directory = str(tmpdir)
+        _touch(os.path.join(directory, "sub", "a.jpg"))
+        _scan(directory)
+        _scan(directory)
+
+        paths, manifest = _scan(directory, full=True)
+
+        assert paths == ["sub/a.jpg"]
+        assert manifest.listed == 2
+
+    def test_retry(self, tmpdir):
+        directory = str(tmpdir)
+        _touch(os.path.join(directory, "sub", "a.jpg"))
+        _scan(directory)
+        _scan(directory)
+
+        manifest = ScanManifest(directory).load()
+        for path, _ in manifest.walk(full=True):
+            manifest.retry(path)
+        manifest.save()
+
+        paths, manifest = _scan(directory)
+
+        assert paths == ["sub/a.jpg"]
+        assert manifest.listed == 1
+
+    def test_skips_symlinked_directories(self, tmpdir):
+        directory = str(tmpdir)
+        _touch(os.path.join(directory, "sub", "a.jpg"))
+        os.symlink(directory, os.path.join(directory, "sub", "loop"))
+
+        paths, manifest = _scan(directory)
+
+        assert paths == ["sub/a.jpg"]
+        assert manifest.listed == 2
+
+
+class TestProbeImage:
+
+    def test_decompression_bomb(self, tmpdir, monkeypatch):
+        path = str(tmpdir.join("large.png"))
+        Image.new('L', (200, 100)).save(path)
+        monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+
+        assert probe_image(path) == (200, 100)
+        assert Image.MAX_IMAGE_PIXELS == 1000
+
+    def test_unreadable(self, tmpdir):
+        path = str(tmpdir.join("broken.jpg"))
+        tmpdir.join("broken.jpg").write("not an image")
+
+        assert probe_image(path) is None
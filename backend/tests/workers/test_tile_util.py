@@ -0,0 +1,66 @@
+import io
+import os
+
+from PIL import Image
+from workers.tile_util import TilePyramid
+
+
+def _build(tmpdir, size=(600, 300), tile_size=256):
+    source = str(tmpdir.join("image.png"))
+    Image.new('RGB', size, (255, 0, 0)).save(source)
+
+    pyramid = TilePyramid(str(tmpdir.join(".tiles", "image.png.tiles")))
+    descriptor = pyramid.build(source, tile_size=tile_size)
+    return source, pyramid, descriptor
+
+
+class TestTilePyramid:
+
+    def test_levels(self, tmpdir):
+        _, _, descriptor = _build(tmpdir)
+        levels = descriptor['levels']
+
+        assert TilePyramid.num_levels(600, 300) == 11
+        assert len(levels) == 11
+        assert (levels[0]['width'], levels[0]['height']) == (1, 1)
+        assert (levels[9]['width'], levels[9]['height']) == (300, 150)
+        assert (levels[10]['width'], levels[10]['height']) == (600, 300)
+        assert (levels[10]['columns'], levels[10]['rows']) == (3, 2)
+        assert (levels[9]['columns'], levels[9]['rows']) == (2, 1)
+
+    def test_read(self, tmpdir):
+        _, pyramid, _ = _build(tmpdir)
+
+        tile = Image.open(io.BytesIO(pyramid.read(10, 2, 1)))
+        assert tile.size == (600 - 512, 300 - 256)
+        assert Image.open(io.BytesIO(pyramid.read(0, 0, 0))).size == (1, 1)
+
+    def test_read_bounds(self, tmpdir):
+        _, pyramid, _ = _build(tmpdir)
+
+        assert pyramid.read(11, 0, 0) is None
+        assert pyramid.read(-1, 0, 0) is None
+        assert pyramid.read(10, 3, 0) is None
+        assert pyramid.read(10, 0, 2) is None
+        assert TilePyramid(str(tmpdir.join("missing.tiles"))).read(0, 0, 0) is None
+
+    def test_is_current(self, tmpdir):
+        source, pyramid, descriptor = _build(tmpdir)
+        assert pyramid.is_current(source)
+
+        stat = os.stat(source)
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        assert not pyramid.is_current(source)
+
+        os.remove(source)
+        assert not pyramid.is_current(source)
+        assert not TilePyramid(str(tmpdir.join("missing.tiles"))).is_current(source)
+
+    def test_reserve(self, tmpdir):
+        pyramid = TilePyramid(str(tmpdir.join(".tiles", "image.png.tiles")))
+
+        assert pyramid.reserve()
+        assert not pyramid.reserve()
+
+        pyramid.release()
+        assert pyramid.reserve()
@@ -4,6 +4,7 @@ from werkzeug.security import generate_password_hash
 
 from database import UserModel
 from ..util.query_util import fix_ids
+from ..util.image_cache import image_cache
 
 api = Namespace('admin', description='Admin related operations')
 
@@ -139,3 +140,15 @@ class Username(Resource):
         user.delete()
         return {"success": True}
 
+
+@api.route('/image_cache')
+class ImageCache(Resource):
+
+    @login_required
+    def get(self):
+        """ Hit, miss and eviction counts of this process's resized image cache """
+
+        if not current_user.is_admin:
+            return {"success": False, "message": "Access denied"}, 401
+
+        return image_cache.stats()
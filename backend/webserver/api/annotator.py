@@ -44,19 +44,39 @@ class AnnotatorData(Resource):
         
         db_dataset.update(annotate_url=dataset.get('annotate_url', ''))
         
-        categories = CategoryModel.objects.all()
-        annotations = AnnotationModel.objects(image_id=image_id)
+        data_categories = data.get('categories', [])
+        category_ids = [category.get('id') for category in data_categories]
+        annotation_ids = [
+            annotation.get('id')
+            for category in data_categories
+            for annotation in category.get('annotations', [])
+        ]
+
+        # Load every category and annotation of the image once, instead of
+        # one query per object
+        categories = {
+            category.id: category for category in
+            CategoryModel.objects(id__in=category_ids)
+        }
+        annotations = {
+            annotation.id: annotation for annotation in
+            AnnotationModel.objects(image_id=image_id, id__in=annotation_ids)
+                .only('id', 'width', 'height')
+        }
 
         current_user.update(preferences=data.get('user', {}))
 
+        category_updates = {}
+        annotation_updates = {}
+
         annotated = False
         num_annotations = 0
         # Iterate every category passed in the data
-        for category in data.get('categories', []):
+        for category in data_categories:
             category_id = category.get('id')
 
             # Find corresponding category object in the database
-            db_category = categories.filter(id=category_id).first()
+            db_category = categories.get(category_id)
             if db_category is None:
                 continue
 
@@ -65,21 +85,25 @@ class AnnotatorData(Resource):
                 category_update['keypoint_edges'] = category.get('keypoint_edges', [])
                 category_update['keypoint_labels'] = category.get('keypoint_labels', [])
                 category_update['keypoint_colors'] = category.get('keypoint_colors', [])
-            
-            db_category.update(**category_update)
+
+            # Only categories which changed are written
+            if any(db_category[field] != value for field, value in category_update.items()):
+                category_updates[category_id] = {
+                    f'set__{field}': value for field, value in category_update.items()
+                }
 
             # Iterate every annotation from the data annotations
             for annotation in category.get('annotations', []):
                 counted = False
                 # Find corresponding annotation object in database
                 annotation_id = annotation.get('id')
-                db_annotation = annotations.filter(id=annotation_id).first()
+                db_annotation = annotations.get(annotation_id)
 
                 if db_annotation is None:
                     continue
 
-                # Paperjs objects are complex, so they will not always be passed. Therefor we update
-                # the annotation twice, checking if the paperjs exists.
+                # Paperjs objects are complex, so they will not always be passed. Therefor
+                # the segmentation is only updated if the paperjs object exists.
 
                 # Update annotation in database
                 sessions = []
@@ -99,14 +123,14 @@ class AnnotatorData(Resource):
                 if keypoints:
                     counted = True
 
-                db_annotation.update(
-                    add_to_set__events=sessions,
-                    inc__milliseconds=total_time,
-                    set__isbbox=annotation.get('isbbox', False),
-                    set__keypoints=keypoints,
-                    set__metadata=annotation.get('metadata'),
-                    set__color=annotation.get('color')
-                )
+                annotation_update = {
+                    'add_to_set__events': sessions,
+                    'inc__milliseconds': total_time,
+                    'set__isbbox': annotation.get('isbbox', False),
+                    'set__keypoints': keypoints,
+                    'set__metadata': annotation.get('metadata'),
+                    'set__color': annotation.get('color')
+                }
 
                 paperjs_object = annotation.get('compoundPath', [])
 
@@ -120,10 +144,9 @@ class AnnotatorData(Resource):
                     segmentation, area, bbox = coco_util.\
                         paperjs_to_coco(width, height, paperjs_object)
 
-                    db_annotation.update(
+                    annotation_update.update(
                         set__segmentation=segmentation,
                         set__area=area,
-                        set__isbbox=annotation.get('isbbox', False),
                         set__bbox=bbox,
                         set__paper_object=paperjs_object,
                     )
@@ -131,9 +154,15 @@ class AnnotatorData(Resource):
                     if area > 0:
                         counted = True
 
+                annotation_updates[annotation_id] = annotation_update
+
                 if counted:
                     num_annotations += 1
 
+        # Changes are written with one bulk write per collection
+        CategoryModel.bulk_update(category_updates)
+        AnnotationModel.bulk_update(annotation_updates)
+
         image_model.update(
             set__metadata=image.get('metadata', {}),
             set__annotated=(num_annotations > 0),
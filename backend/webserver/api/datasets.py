@@ -1,5 +1,5 @@
 from flask import request
-from flask_restplus import Namespace, Resource, reqparse
+from flask_restplus import Namespace, Resource, reqparse, inputs
 from flask_login import login_required, current_user
 from werkzeug.datastructures import FileStorage
 from mongoengine.errors import NotUniqueError
@@ -9,6 +9,7 @@ from threading import Thread
 from google_images_download import google_images_download as gid
 
 from ..util.pagination_util import Pagination
+from ..util.import_util import save_import
 from ..util import query_util, coco_util, profile
 
 from database import (
@@ -49,6 +50,14 @@ coco_upload.add_argument('coco', location='files', type=FileStorage, required=Tr
 
 export = reqparse.RequestParser()
 export.add_argument('categories', type=str, default=None, required=False, help='Ids of categories to export')
+export.add_argument('shards', type=int, default=1, required=False,
+                    help='Number of workers to split the export across')
+export.add_argument('delta', type=inputs.boolean, default=False, required=False,
+                    help='Only re-read images changed since the last export')
+export.add_argument('style', default='COCO', choices=('COCO', 'PARQUET'),
+                    help='Export format')
+export.add_argument('mask_format', default='polygon', choices=('polygon', 'rle'),
+                    help='Export segmentation as polygons or compressed RLE')
 
 update_dataset = reqparse.RequestParser()
 update_dataset.add_argument('categories', location='json', type=list, help="New list of categories")
@@ -67,6 +76,10 @@ cs_data = reqparse.RequestParser()
 cs_data.add_argument('rejected', location='json', type=list, default=[], help="List of images to filter")
 cs_data.add_argument('dummy', location='json', type=bool, default=False)
 
+scan = reqparse.RequestParser()
+scan.add_argument('full', type=inputs.boolean, default=False,
+                  help='List every directory, even those unchanged since the last scan')
+
 dataset_refresh = reqparse.RequestParser()
 dataset_refresh.add_argument('dataset_id', location='json', type=int)
 
@@ -654,7 +667,13 @@ class DatasetExport(Resource):
         if not dataset:
             return {'message': 'Invalid dataset ID'}, 400
         
-        return dataset.export_coco(categories=categories)
+        return dataset.export_coco(
+            categories=categories,
+            style=args.get('style'),
+            shards=args.get('shards'),
+            delta=args.get('delta'),
+            mask_format=args.get('mask_format')
+        )
     
     @api.expect(coco_upload)
     @login_required
@@ -667,7 +686,7 @@ class DatasetExport(Resource):
         if dataset is None:
             return {'message': 'Invalid dataset ID'}, 400
 
-        return dataset.import_coco(json.load(coco))
+        return dataset.import_coco(save_import(dataset, coco))
 
 
 @api.route('/<int:dataset_id>/coco')
@@ -697,7 +716,7 @@ class DatasetCoco(Resource):
         if dataset is None:
             return {'message': 'Invalid dataset ID'}, 400
 
-        return dataset.import_coco(json.load(coco))
+        return dataset.import_coco(save_import(dataset, coco))
 
 
 @api.route('/coco/<int:import_id>')
@@ -721,15 +740,31 @@ class DatasetCocoId(Resource):
 @api.route('/<int:dataset_id>/scan')
 class DatasetScan(Resource):
     
+    @api.expect(scan)
     @login_required
     def get(self, dataset_id):
 
+        args = scan.parse_args()
         dataset = DatasetModel.objects(id=dataset_id).first()
         
         if not dataset:
             return {'message': 'Invalid dataset ID'}, 400
         
-        return dataset.scan()
+        return dataset.scan(full=args.get('full'))
+
+
+@api.route('/<int:dataset_id>/reindex')
+class DatasetReindex(Resource):
+
+    @login_required
+    def get(self, dataset_id):
+        """ Recomputes the annotation counters of the dataset's images """
+        dataset = current_user.datasets.filter(id=dataset_id).first()
+
+        if not dataset:
+            return {'message': 'Invalid dataset ID'}, 400
+
+        return dataset.reindex()
 
 @api.route('/<int:dataset_id>/cs_refersh')
 class DatasetRefresh(Resource):
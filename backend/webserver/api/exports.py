@@ -1,9 +1,9 @@
-from flask import send_file
 from flask_restplus import Namespace, Resource, reqparse
 from flask_login import login_required, current_user
 
 import datetime
 from ..util import query_util
+from ..util.export_util import send_export
 
 from database import (
     ExportModel,
@@ -67,5 +67,5 @@ class DatasetExports(Resource):
         if not current_user.can_download(dataset):
             return {"message": "You do not have permission to download the dataset's annotations"}, 403
 
-        return send_file(export.path, attachment_filename=f"{dataset.name.encode('utf-8')}-{'-'.join(export.tags).encode('utf-8')}.json", as_attachment=True)
+        return send_export(export, filename=f"{dataset.name}-{'-'.join(export.tags)}{export.extension}", as_attachment=True)
 
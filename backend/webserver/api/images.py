@@ -1,9 +1,20 @@
 from flask_restplus import Namespace, Resource, reqparse
 from flask_login import login_required, current_user
+from flask import Response, request, send_file
 from werkzeug.datastructures import FileStorage
-from flask import send_file
 
 from ..util import query_util, coco_util
+from ..util.image_cache import image_cache
+from ..util.image_util import (
+    IMAGE_FORMATS,
+    encode_image,
+    image_format,
+    image_variant,
+    is_browser_format,
+    is_oriented,
+    send_image
+)
+from workers.tile_util import TilePyramid
 from database import (
     ImageModel,
     DatasetModel,
@@ -139,16 +150,52 @@ class ImageId(Resource):
             width = image.width
         if not height:
             height = image.height
-        
-        pil_image = image.open_thumbnail() if thumbnail else Image.open(image.path)
 
-        pil_image.thumbnail((width, height), Image.ANTIALIAS)
-        image_io = io.BytesIO()
-        pil_image = pil_image.convert("RGB")
-        pil_image.save(image_io, "JPEG", quality=90)
-        image_io.seek(0)
+        # Downloads keep the JPEG format their file name suggests
+        format = 'JPEG' if as_attachment else image_format()
+        mimetype = IMAGE_FORMATS[format]
+
+        if thumbnail:
+            # Stored thumbnails are served as they are, the smallest which
+            # covers the requested size is picked
+            path = image.thumbnail_path(image.thumbnail_size(width, height))
+            if os.path.isfile(path):
+                path = image_variant(path, format)
+                response = send_image(path, image.file_name, (width, height),
+                                      mimetype=mimetype,
+                                      as_attachment=as_attachment)
+                response.vary.add('Accept')
+                return response
+
+        elif width >= image.width and height >= image.height \
+                and is_browser_format(image.path) \
+                and not is_oriented(image.path):
+            # Originals which need no resizing are sent as they are stored
+            return send_image(image.path, image.file_name, (width, height),
+                              as_attachment=as_attachment)
+
+        source = image.thumbnail_path() if thumbnail else image.path
+        cache_path = image_cache.path(image.id, source, width, height, format)
+
+        data = None
+        if image_cache.get(cache_path) is None:
+            data = _resize_image(source, width, height, format)
+            image_cache.put(cache_path, data)
 
-        return send_file(image_io, attachment_filename=image.file_name, as_attachment=as_attachment)
+        try:
+            response = send_image(cache_path, image.file_name, (width, height),
+                                  mimetype=mimetype, as_attachment=as_attachment)
+        except FileNotFoundError:
+            # The entry was evicted by another process since it was looked
+            # up, the image is sent from memory instead
+            if data is None:
+                data = _resize_image(source, width, height, format)
+            response = send_file(io.BytesIO(data), mimetype=mimetype,
+                                 attachment_filename=image.file_name,
+                                 as_attachment=as_attachment)
+
+        response.vary.add('Accept')
+        return response
 
     # to do @sriram
     # uncomment below to delete from cs
@@ -188,6 +235,75 @@ class ImageId(Resource):
         return{"message": "Updated image", "annotating": image.cs_annotating, "annotated by": image.cs_annotated}
 
 
+@api.route('/<int:image_id>/tiles')
+class ImageTiles(Resource):
+
+    @login_required
+    def get(self, image_id):
+        """ Returns the deep zoom descriptor of an image, building its tiles if required """
+        from workers.tasks import generate_tiles
+
+        image = current_user.images.filter(id=image_id, deleted=False) \
+            .only('id', 'path').first()
+        if image is None:
+            return {"message": "Invalid image id"}, 400
+
+        if not os.path.isfile(image.path):
+            return {"message": "Image file not found"}, 404
+
+        pyramid = TilePyramid(image.tiles_path())
+        if not pyramid.is_current(image.path):
+            # Requests polling for the tiles while they are built do not
+            # queue the build again
+            if pyramid.reserve():
+                generate_tiles.delay(image.id)
+            return {"success": False, "message": "Tiles are being generated"}, 202
+
+        descriptor = pyramid.descriptor()
+        if descriptor is None:
+            return {"success": False, "message": "Tiles are being generated"}, 202
+
+        return {
+            "width": descriptor['width'],
+            "height": descriptor['height'],
+            "tile_size": descriptor['tile_size'],
+            "overlap": descriptor['overlap'],
+            "format": descriptor['format'],
+            "levels": len(descriptor['levels']),
+            "url": f"/api/image/{image.id}/tiles/{{level}}/{{column}}_{{row}}.jpeg"
+        }
+
+
+@api.route('/<int:image_id>/tiles/<int:level>/<int:column>_<int:row>.jpeg')
+class ImageTile(Resource):
+
+    @login_required
+    def get(self, image_id, level, column, row):
+        """ Returns one tile of an image's deep zoom pyramid """
+        image = current_user.images.filter(id=image_id, deleted=False) \
+            .only('id', 'path').first()
+        if image is None:
+            return {"message": "Invalid image id"}, 400
+
+        pyramid = TilePyramid(image.tiles_path())
+
+        # The version is read before the tile, so a pyramid replaced in
+        # between never sends an older tile under a newer ETag
+        descriptor = pyramid.descriptor()
+        version = descriptor.get('source_mtime') if descriptor else None
+        if version is None:
+            return {"success": False, "message": "Tiles are being generated"}, 202
+
+        tile = pyramid.read(level, column, row)
+        if tile is None:
+            return {"message": "Invalid tile"}, 404
+
+        response = Response(tile, mimetype='image/jpeg')
+        response.set_etag(f"{image.id}-{version}-{level}-{column}-{row}")
+
+        return response.make_conditional(request)
+
+
 @api.route('/copy/<int:from_id>/<int:to_id>/annotations')
 class ImageCopyAnnotations(Resource):
 
@@ -250,4 +366,16 @@ class ImageFlag(Resource):
         image = current_user.images.filter(id=image_id).first()
         if is_flag:
             image.update(add_to_set__cs_flagged_users=current_user.username)
-        return {'success': True}
\ No newline at end of file
+        return {'success': True}
+
+def _resize_image(path, width, height, format):
+    """
+    Resizes an image to fit in width x height
+
+    :return: encoded image (bytes)
+    """
+    pil_image = Image.open(path)
+    pil_image.draft('RGB', (width, height))
+
+    pil_image.thumbnail((width, height), Image.ANTIALIAS)
+    return encode_image(pil_image, format)
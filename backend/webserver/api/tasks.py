@@ -1,4 +1,4 @@
-from flask_restplus import Namespace, Resource
+from flask_restplus import Namespace, Resource, reqparse, inputs
 from flask_login import login_required
 
 from ..util import query_util
@@ -8,6 +8,13 @@ from database import TaskModel
 api = Namespace('tasks', description='Task related operations')
 
 
+logs_parser = reqparse.RequestParser()
+logs_parser.add_argument('cursor', type=int, default=0, help='Position of the first line')
+logs_parser.add_argument('limit', type=int, default=1000, help='Maximum number of lines')
+logs_parser.add_argument('tail', type=inputs.boolean, default=False,
+                         help='Return the last lines instead of the lines after cursor')
+
+
 @api.route('/')
 class Task(Resource):
     @login_required
@@ -40,11 +47,21 @@ class TaskId(Resource):
 
 @api.route('/<int:task_id>/logs')
 class TaskId(Resource):
+    @api.expect(logs_parser)
     @login_required
     def get(self, task_id):
-        """ Deletes task """
-        task = TaskModel.objects(id=task_id).first()
+        """ Returns log lines of a task written after a cursor """
+        args = logs_parser.parse_args()
+        cursor = max(args.get('cursor'), 0)
+        limit = min(max(args.get('limit'), 1), 10000)
+
+        task = TaskModel.objects(id=task_id).exclude('logs').first()
         if task is None:
             return {"message": "Invalid task id"}, 400
-        
-        return {'logs': task.logs}
+
+        if args.get('tail'):
+            cursor = max(task.log_length() - limit, 0)
+
+        start = cursor
+        logs, cursor, more = task.read_logs(cursor, limit)
+        return {'logs': logs, 'start': start, 'cursor': cursor, 'more': more}
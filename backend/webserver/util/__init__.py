@@ -2,6 +2,7 @@
 
 import time
 import logging
+logger = logging.getLogger('gunicorn.error')
 
 
 def profile(func):
@@ -9,8 +10,13 @@ def profile(func):
         started_at = time.time()
         result = func(*args, **kwargs)
         diff = time.time() - started_at
-        if isinstance(result, dict):
-            result['time_ms'] = int(diff * 1000)
+
+        # Responses can be returned with a status code, e.g. ({...}, 400)
+        body = result[0] if isinstance(result, tuple) else result
+        if isinstance(body, dict):
+            body['time_ms'] = int(diff * 1000)
+
+        logger.debug(f'{func.__qualname__} took {int(diff * 1000)}ms')
         return result
 
     return wrap
\ No newline at end of file
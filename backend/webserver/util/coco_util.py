@@ -10,6 +10,7 @@ from database import (
     CategoryModel,
     AnnotationModel
 )
+from workers.export_util import merge_segmentation
 
 
 def paperjs_to_coco(image_width, image_height, paperjs):
@@ -189,8 +190,7 @@ def paperjs_to_coco_cliptobounds(image_width, image_height, paperjs): # todo: th
 
 def get_segmentation_area_and_bbox(segmentation, image_height, image_width):
     # Convert into rle
-    rles = mask.frPyObjects(segmentation, image_height, image_width)
-    rle = mask.merge(rles)
+    rle = merge_segmentation(segmentation, image_height, image_width)
 
     return mask.area(rle), mask.toBbox(rle)
 
@@ -0,0 +1,67 @@
+from flask import Response, request, send_file
+from werkzeug.urls import url_quote
+
+import unicodedata
+
+from workers.export_util import open_export
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def send_export(export, filename=None, as_attachment=False):
+    """
+    Sends an export file. Compressed exports are sent as they are stored
+    when the client accepts their content encoding, otherwise they are
+    decompressed while streaming.
+
+    :param export: ExportModel
+    :param filename: name of the downloaded file
+    :param as_attachment: send file as an attachment
+    :return: flask response
+    """
+    encoding = export.encoding
+
+    if encoding is None:
+        return send_file(export.path, mimetype=export.mimetype,
+                         attachment_filename=filename,
+                         as_attachment=as_attachment)
+
+    if encoding in request.accept_encodings:
+        response = send_file(export.path, mimetype='application/json',
+                             attachment_filename=filename,
+                             as_attachment=as_attachment)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    def generate():
+        with open_export(export.path, 'r', encoding) as fp:
+            while True:
+                chunk = fp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    response = Response(generate(), mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if as_attachment:
+        response.headers.set('Content-Disposition', 'attachment',
+                             **_filename_options(filename))
+    return response
+
+
+def _filename_options(filename):
+    """
+    Returns Content-Disposition options for a file name, names which are
+    not latin-1 are sent with an ascii fallback (as send_file does)
+    """
+    try:
+        filename.encode('latin-1')
+        return {'filename': filename}
+    except UnicodeEncodeError:
+        return {
+            'filename': unicodedata.normalize('NFKD', filename)
+                .encode('ascii', 'ignore').decode('ascii'),
+            'filename*': "UTF-8''" + url_quote(filename)
+        }
@@ -0,0 +1,185 @@
+from config import Config
+
+import contextlib
+import threading
+import hashlib
+import fcntl
+import time
+import os
+
+
+class ImageCache:
+    """
+    Disk backed least recently used cache of resized images. Entries are
+    keyed by image id, source file and its modification time, size and
+    format, so a changed source file is never served from the cache.
+    Every process of the webserver shares the files on disk and their total
+    size, which is kept in a file updated under a lock. Hits and evictions
+    are counted per process.
+    """
+
+    #: Fraction of max_size the cache is trimmed down to once it is full
+    LOW_WATERMARK = 0.9
+
+    #: File holding the total size of the entries, next to their folders
+    SIZE_FILE = 'size'
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.size_path = os.path.join(directory, self.SIZE_FILE)
+
+    def path(self, image_id, source, width, height, format):
+        """
+        Returns the path an entry is stored at
+
+        :param image_id: id of the image
+        :param source: path of the file the entry is resized from
+        """
+        mtime = os.stat(source).st_mtime_ns
+        key = f"{image_id}:{source}:{mtime}:{width}x{height}:{format}"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.directory, digest[:2], f"{digest}.{format.lower()}")
+
+    def get(self, path):
+        """
+        Returns path if the entry is cached, or None
+        """
+        try:
+            # Access time orders entries for eviction, modification time
+            # is left as it is so the entry can be validated by clients
+            stat = os.stat(path)
+            os.utime(path, ns=(int(time.time() * 1e9), stat.st_mtime_ns))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def put(self, path, data):
+        """
+        Stores an entry and evicts the least recently used entries once the
+        cache takes up more than max_size bytes
+
+        :param data: encoded image (bytes)
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Other processes may read the entry while it is being written
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+
+        with self._size_file() as f:
+            try:
+                # Another process may have stored the same entry meanwhile
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temp_path, path)
+
+            size = self._read_size(f)
+            if size is None:
+                size = self._disk_size()
+            else:
+                size += len(data) - replaced
+
+            if size > self.max_size:
+                size = self._evict()
+
+            self._write_size(f, size)
+
+        return path
+
+    def stats(self):
+        try:
+            with open(self.size_path) as f:
+                size = self._read_size(f)
+        except FileNotFoundError:
+            size = None
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': size if size is not None else self._disk_size(),
+            'max_size': self.max_size
+        }
+
+    @contextlib.contextmanager
+    def _size_file(self):
+        """
+        Opens the size file, locked so processes update it one at a time
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        fd = os.open(self.size_path, os.O_RDWR | os.O_CREAT)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield f
+
+    @staticmethod
+    def _read_size(f):
+        f.seek(0)
+        try:
+            return int(f.read())
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _write_size(f, size):
+        f.seek(0)
+        f.truncate()
+        f.write(str(size))
+        f.flush()
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return
+
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    yield entry.path, entry.stat()
+                except FileNotFoundError:
+                    continue
+
+    def _disk_size(self):
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the cache is below
+        the low watermark
+
+        :return: total size of the remaining entries
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_atime)
+        size = sum(stat.st_size for _, stat in entries)
+        target = self.max_size * self.LOW_WATERMARK
+
+        for path, stat in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= stat.st_size
+            self.evictions += 1
+
+        return size
+
+
+image_cache = ImageCache(Config.IMAGE_CACHE_DIRECTORY, Config.IMAGE_CACHE_MAX_SIZE)
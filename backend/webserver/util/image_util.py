@@ -0,0 +1,135 @@
+from flask import request, send_file
+from config import Config
+from PIL import Image
+
+import collections
+import hashlib
+import io
+import os
+
+try:
+    # Registers AVIF with Pillow versions which cannot encode it
+    import pillow_avif
+except ImportError:
+    pass
+
+
+#: Formats browsers display, originals in these formats are sent as stored
+BROWSER_FORMATS = (".gif", ".png", ".jpg", ".jpeg")
+
+#: EXIF tag of the orientation browsers display images in
+EXIF_ORIENTATION = 0x0112
+
+#: Formats sent to clients which accept them, most preferred first
+IMAGE_FORMATS = collections.OrderedDict([
+    ('AVIF', 'image/avif'),
+    ('WEBP', 'image/webp'),
+    ('JPEG', 'image/jpeg')
+])
+
+
+def image_format():
+    """
+    Returns the format images are encoded in for the current request, the
+    first of IMAGE_FORMATS listed in the Accept header which Pillow can
+    encode, or JPEG
+    """
+    accepted = {value for value, quality in request.accept_mimetypes
+                if quality > 0}
+
+    Image.init()
+    for format, mimetype in IMAGE_FORMATS.items():
+        if mimetype in accepted and format in Image.SAVE:
+            return format
+
+    return 'JPEG'
+
+
+def encode_image(pil_image, format):
+    """
+    Encodes an image at the quality configured for its format
+
+    :return: encoded image (bytes)
+    """
+    quality = {
+        'AVIF': Config.AVIF_QUALITY,
+        'WEBP': Config.WEBP_QUALITY
+    }.get(format, 90)
+
+    image_io = io.BytesIO()
+    pil_image.convert("RGB").save(image_io, format, quality=quality)
+    return image_io.getvalue()
+
+
+def image_variant(path, format):
+    """
+    Returns the path of a copy of a stored JPEG in another format, which is
+    kept next to it and encoded again once the JPEG changes
+
+    :param path: path of the JPEG image
+    :param format: format of the copy
+    """
+    if format == 'JPEG':
+        return path
+
+    variant_path = f"{path}.{format.lower()}"
+    try:
+        if os.stat(variant_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return variant_path
+    except FileNotFoundError:
+        pass
+
+    with Image.open(path) as pil_image:
+        data = encode_image(pil_image, format)
+
+    temp_path = f"{variant_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, variant_path)
+
+    return variant_path
+
+
+def send_image(path, filename=None, size=None, mimetype=None,
+               as_attachment=False):
+    """
+    Sends an image file with a strong ETag. Requests which already hold the
+    image are answered with 304 Not Modified, and byte ranges are sent for
+    range requests. The file is read in chunks by the webserver, which runs
+    with sendfile disabled.
+
+    :param path: path of the image file
+    :param filename: name of the downloaded file
+    :param size: (width, height) requested by the client
+    :param mimetype: mimetype of the file, guessed from its name if None
+    :param as_attachment: send file as an attachment
+    :return: flask response
+    """
+    stat = os.stat(path)
+    key = f"{path}:{stat.st_mtime_ns}:{stat.st_size}:{size}"
+
+    response = send_file(path, mimetype=mimetype,
+                         attachment_filename=filename,
+                         as_attachment=as_attachment,
+                         add_etags=False)
+    response.set_etag(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    return response.make_conditional(request, accept_ranges=True,
+                                     complete_length=stat.st_size)
+
+
+def is_browser_format(path):
+    return path.lower().endswith(BROWSER_FORMATS)
+
+
+def is_oriented(path):
+    """
+    Returns True if an image has an EXIF orientation other than the stored
+    one. Browsers rotate such images, while annotations are drawn on the
+    image as stored, so they are encoded again without EXIF data.
+    """
+    try:
+        with Image.open(path) as pil_image:
+            return pil_image.getexif().get(EXIF_ORIENTATION, 1) != 1
+    except (OSError, ValueError, SyntaxError):
+        return False
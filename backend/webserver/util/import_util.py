@@ -0,0 +1,20 @@
+import time
+import os
+
+
+def save_import(dataset, upload):
+    """
+    Spools an uploaded coco file to the imports directory of a dataset, so
+    workers can read it from disk
+
+    :param dataset: DatasetModel the file is imported into
+    :param upload: uploaded file (FileStorage)
+    :return: path of the saved file
+    """
+    directory = f"{dataset.directory}.imports/"
+    os.makedirs(directory, exist_ok=True)
+
+    path = f"{directory}coco-{time.time()}.json"
+    upload.save(path)
+
+    return path
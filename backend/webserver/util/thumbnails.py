@@ -1,10 +1,9 @@
-from database import ImageModel
-
-
 def generate_thumbnails():
+    from workers.tasks import thumbnail_generate_batches
+
     PREFIX = "[Thumbnails]"
     print(f'{PREFIX} Sending request for regenerating images with non actual thumbnails', flush=True)
-    [generate_thumbnail(image) for image in ImageModel.objects(regenerate_thumbnail=True).all()]
+    thumbnail_generate_batches({})
 
 
 def generate_thumbnail(image):
@@ -1,6 +1,7 @@
 from celery import Celery
+from celery.signals import task_postrun
 from config import Config
-from database import connect_mongo
+from database import connect_mongo, flush_task_logs
 
 connect_mongo('Celery_Worker')
 
@@ -12,5 +13,11 @@ celery = Celery(
 celery.autodiscover_tasks(['workers.tasks'])
 
 
+@task_postrun.connect
+def flush_logs(**kwargs):
+    """ Writes log lines tasks buffered while running """
+    flush_task_logs()
+
+
 if __name__ == '__main__':
     celery.start()
@@ -0,0 +1,518 @@
+from database import ExportModel
+from billiard import Pool
+
+import pycocotools.mask as mask
+import numpy as np
+import tempfile
+import shutil
+import gzip
+import time
+import json
+import io
+import os
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+def export_encoding(encoding):
+    """
+    Returns the content encoding to write exports with, falling back to
+    gzip when zstd is not installed
+
+    :param encoding: requested encoding ("gzip", "zstd" or "none")
+    :return: encoding or None for uncompressed exports
+    """
+    encoding = (encoding or '').lower()
+    if encoding == 'zstd' and zstd is None:
+        return 'gzip'
+    if encoding not in ExportModel.ENCODINGS:
+        return None
+    return encoding
+
+
+def open_export(path, mode='r', encoding=None, level=None):
+    """
+    Opens an export file in text mode, compressing or decompressing it
+    with the given content encoding
+
+    :param path: path of the export
+    :param mode: "r" or "w"
+    :param encoding: "gzip", "zstd" or None
+    :param level: compression level used when writing
+    :return: file object
+    """
+    if encoding == 'gzip':
+        return gzip.open(path, mode + 't', compresslevel=level or 6)
+
+    if encoding == 'zstd':
+        fp = open(path, mode + 'b')
+        if mode == 'r':
+            stream = zstd.ZstdDecompressor().stream_reader(fp)
+        else:
+            stream = zstd.ZstdCompressor(level=level or 3).stream_writer(fp)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+
+    return open(path, mode)
+
+
+def format_category(category):
+    """
+    Converts a category document (in dictionary format) into coco format
+
+    :param category: category dictionary
+    :return: category dictionary with keypoints and skeleton renamed
+    """
+    if len(category.get('keypoint_labels', [])) > 0:
+        category['keypoints'] = category.pop('keypoint_labels', [])
+        category['skeleton'] = category.pop('keypoint_edges', [])
+    else:
+        if 'keypoint_edges' in category:
+            del category['keypoint_edges']
+        if 'keypoint_labels' in category:
+            del category['keypoint_labels']
+
+    return category
+
+
+def format_annotation(annotation):
+    """
+    Converts an annotation document (in dictionary format) into coco format
+
+    :param annotation: annotation dictionary
+    :return: annotation dictionary or None if the annotation is empty
+    """
+    has_keypoints = len(annotation.get('keypoints', [])) > 0
+    has_segmentation = len(annotation.get('segmentation', [])) > 0
+
+    if not has_keypoints and not has_segmentation:
+        return None
+
+    if not has_keypoints:
+        if 'keypoints' in annotation:
+            del annotation['keypoints']
+    else:
+        arr = np.array(annotation.get('keypoints', []))
+        arr = arr[2::3]
+        annotation['num_keypoints'] = len(arr[arr > 0])
+
+    return annotation
+
+
+def merge_segmentation(segmentation, image_height, image_width):
+    """
+    Merges the polygons of a segmentation into one RLE mask
+
+    :return: RLE as encoded by pycocotools (counts as bytes)
+    """
+    rles = mask.frPyObjects(segmentation, image_height, image_width)
+    return mask.merge(rles)
+
+
+def segmentation_to_rle(segmentation, image_height, image_width):
+    """
+    Encodes polygon segmentation as compressed RLE
+
+    :return: RLE in coco format (counts as a string)
+    :raises ValueError: if the segmentation is not a list of polygons
+    """
+    # pycocotools reads lists of 4 values as boxes, and fails on shorter ones
+    if not all(isinstance(polygon, list) and len(polygon) >= 6
+               and len(polygon) % 2 == 0 for polygon in segmentation):
+        raise ValueError("Segmentation has polygons with fewer than 3 points")
+
+    rle = merge_segmentation(segmentation, image_height, image_width)
+    rle['counts'] = rle['counts'].decode('ascii')
+
+    return rle
+
+
+def _encode_rle(job):
+    segmentation, image_height, image_width = job
+
+    try:
+        rle = segmentation_to_rle(segmentation, image_height, image_width)
+    except (ValueError, TypeError) as e:
+        return None, str(e)
+
+    polygon_size = len(json.dumps(segmentation))
+    rle_size = len(json.dumps(rle))
+
+    return rle, (polygon_size, rle_size)
+
+
+class RLEEncoder:
+    """
+    Converts the segmentation of batches of annotations into RLE using a
+    pool of processes, and keeps statistics about the conversion
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes or os.cpu_count() or 1
+        # Encoded in the calling process when there is only one process
+        self.pool = Pool(self.processes) if self.processes > 1 else None
+
+        self.count = 0
+        self.seconds = 0
+        self.polygon_size = 0
+        self.rle_size = 0
+
+    def encode(self, batch):
+        """
+        Replaces the polygon segmentation of annotations in place.
+        Annotations which cannot be encoded keep their polygons.
+
+        :param batch: list of (image, annotations) in coco format
+        :return: list of (annotation, error) which could not be encoded
+        """
+        started_at = time.time()
+
+        targets = []
+        jobs = []
+        for image, annotations in batch:
+            for annotation in annotations:
+                segmentation = annotation.get('segmentation', [])
+                if len(segmentation) == 0:
+                    continue
+
+                targets.append(annotation)
+                jobs.append((segmentation, image['height'], image['width']))
+
+        if self.pool is None:
+            results = map(_encode_rle, jobs)
+        else:
+            chunksize = max(len(jobs) // (self.processes * 4), 1)
+            results = self.pool.map(_encode_rle, jobs, chunksize)
+
+        failed = []
+        for annotation, (rle, result) in zip(targets, results):
+            if rle is None:
+                failed.append((annotation, result))
+                continue
+
+            annotation['segmentation'] = rle
+            self.polygon_size += result[0]
+            self.rle_size += result[1]
+            self.count += 1
+
+        self.seconds += time.time() - started_at
+        return failed
+
+    def summary(self):
+        rate = self.count / self.seconds if self.seconds > 0 else 0
+        return (f"Encoded {self.count} annotations as RLE in "
+                f"{self.seconds:.1f}s ({rate:.0f} annotations/s, "
+                f"{self.processes} processes). Segmentation size "
+                f"{self.polygon_size} bytes as polygons, "
+                f"{self.rle_size} bytes as RLE")
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+
+def iter_image_annotations(images, annotations):
+    """
+    Merges an image cursor with an annotation cursor in a single pass.
+
+    :param images: images sorted by id
+    :param annotations: annotations sorted by image_id
+    :return: generator of (image, list of annotations) for every image
+    """
+    annotations = iter(annotations)
+    current = next(annotations, None)
+
+    for image in images:
+        # Skip annotations that belong to images which are not exported,
+        # or to images which no longer exist
+        while current is not None and (current.image_id is None
+                                       or current.image_id < image.id):
+            current = next(annotations, None)
+
+        image_annotations = []
+        while current is not None and current.image_id == image.id:
+            image_annotations.append(current)
+            current = next(annotations, None)
+
+        yield image, image_annotations
+
+
+def iter_export_records(fp):
+    """
+    Reads a coco file written by CocoWriter one record at a time
+
+    :param fp: file object of the coco file
+    :return: generator of (section, record in JSON format)
+    """
+    section = None
+    for line in fp:
+        line = line.strip()
+
+        if line.startswith('"') and line.endswith('['):
+            section = line.split('"')[1]
+            continue
+
+        if not line.startswith('{') or len(line) == 1:
+            # Closing brackets, or the opening bracket of the file
+            continue
+
+        yield section, line.rstrip(',')
+
+
+class ArrayWriter:
+    """
+    Writes JSON objects to a file as the items of an array, one item per line
+    (without the surrounding brackets)
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+
+    def write(self, obj):
+        if self.count > 0:
+            self.fp.write(',\n')
+        json.dump(obj, self.fp)
+        self.count += 1
+
+    def write_raw(self, text):
+        """ Writes an item which is already in JSON format """
+        if self.count > 0:
+            self.fp.write(',\n')
+        self.fp.write(text)
+        self.count += 1
+
+
+class CocoWriter:
+    """
+    Streams a coco file to disk one record at a time.
+
+    Records of every section are spooled into temporary files next to the
+    export, so memory usage stays constant regardless of the dataset size.
+    The final file is only moved into place once all sections are written,
+    optionally compressed with gzip or zstd.
+    """
+
+    SECTIONS = ('images', 'categories', 'annotations')
+
+    def __init__(self, path, encoding=None, level=None):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self.encoding = encoding
+        self.level = level
+
+        self._parts = {}
+        self._writers = {}
+        self._appended = {}
+        for section in self.SECTIONS:
+            part = tempfile.TemporaryFile('w+', dir=self.directory)
+            self._parts[section] = part
+            self._writers[section] = ArrayWriter(part)
+            self._appended[section] = []
+
+    def write_image(self, image):
+        self._writers['images'].write(image)
+
+    def write_category(self, category):
+        self._writers['categories'].write(category)
+
+    def write_annotation(self, annotation):
+        self._writers['annotations'].write(annotation)
+
+    def write_raw(self, section, text):
+        self._writers[section].write_raw(text)
+
+    def append_part(self, section, path, count):
+        """
+        Adds the records of a part file (written by CocoPartWriter) to a section
+
+        :param section: section the records belong to
+        :param path: path of the part file
+        :param count: number of records in the part file
+        """
+        self._appended[section].append((path, count))
+
+    def count(self, section):
+        appended = sum(count for _, count in self._appended[section])
+        return self._writers[section].count + appended
+
+    def close(self):
+        """
+        Joins all sections into the final coco file
+        """
+        tmp_path = f"{self.path}.tmp"
+
+        with open_export(tmp_path, 'w', self.encoding, self.level) as fp:
+            fp.write('{')
+            for i, section in enumerate(self.SECTIONS):
+                if i > 0:
+                    fp.write(',')
+                fp.write(f'\n"{section}": [\n')
+                self._write_section(fp, section)
+                fp.write('\n]')
+            fp.write('\n}\n')
+
+        os.replace(tmp_path, self.path)
+
+    def _write_section(self, fp, section):
+        part = self._parts[section]
+        part.seek(0)
+
+        first = True
+        if self._writers[section].count > 0:
+            shutil.copyfileobj(part, fp)
+            first = False
+        part.close()
+
+        for path, count in self._appended[section]:
+            if count == 0:
+                continue
+            if not first:
+                fp.write(',\n')
+            with open(path) as appended:
+                shutil.copyfileobj(appended, fp)
+            first = False
+
+    def abort(self):
+        for part in self._parts.values():
+            part.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class CocoPartWriter:
+    """
+    Writes the images and annotations of one export shard into part files,
+    which are later joined into a coco file by CocoWriter.append_part
+    """
+
+    SECTIONS = ('images', 'annotations')
+
+    def __init__(self, directory, shard):
+        self._files = {}
+        self._writers = {}
+        for section in self.SECTIONS:
+            fp = open(self.part_path(directory, shard, section), 'w')
+            self._files[section] = fp
+            self._writers[section] = ArrayWriter(fp)
+
+    @staticmethod
+    def part_path(directory, shard, section):
+        return os.path.join(directory, f"{section}-{shard:05d}.part")
+
+    def write_image(self, image):
+        self._writers['images'].write(image)
+
+    def write_annotation(self, annotation):
+        self._writers['annotations'].write(annotation)
+
+    def count(self, section):
+        return self._writers[section].count
+
+    def close(self):
+        for fp in self._files.values():
+            fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ParquetTableWriter:
+    """
+    Writes rows to a parquet file in record batches of a fixed size
+    """
+
+    def __init__(self, path, schema, batch_size=50000):
+        if pa is None:
+            raise RuntimeError("pyarrow is required for parquet exports")
+
+        self.schema = schema
+        self.batch_size = batch_size
+        self.count = 0
+
+        self._writer = pq.ParquetWriter(path, schema)
+        self._columns = {name: [] for name in schema.names}
+        self._buffered = 0
+
+    def write(self, row):
+        for name, column in self._columns.items():
+            column.append(row.get(name))
+
+        self._buffered += 1
+        if self._buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffered == 0:
+            return
+
+        table = pa.Table.from_pydict(self._columns, schema=self.schema)
+        self._writer.write_table(table)
+
+        self.count += self._buffered
+        self._columns = {name: [] for name in self.schema.names}
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def parquet_schemas():
+    """
+    Returns the schemas of the images, annotations and categories tables
+    of a parquet export
+    """
+    return {
+        'images': pa.schema([
+            ('id', pa.int64()),
+            ('dataset_id', pa.int64()),
+            ('file_name', pa.string()),
+            ('path', pa.string()),
+            ('width', pa.int32()),
+            ('height', pa.int32()),
+            ('num_annotations', pa.int32()),
+            ('date_captured', pa.timestamp('ms'))
+        ]),
+        'annotations': pa.schema([
+            ('id', pa.int64()),
+            ('image_id', pa.int64()),
+            ('category_id', pa.int64()),
+            ('area', pa.float64()),
+            ('bbox', pa.list_(pa.float64())),
+            ('iscrowd', pa.bool_()),
+            ('isbbox', pa.bool_()),
+            ('num_keypoints', pa.int32())
+        ]),
+        'categories': pa.schema([
+            ('id', pa.int64()),
+            ('name', pa.string()),
+            ('supercategory', pa.string()),
+            ('color', pa.string())
+        ])
+    }
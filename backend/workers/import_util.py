@@ -0,0 +1,364 @@
+from database import AnnotationModel, reserve_ids
+
+import imantics as im
+import datetime
+import hashlib
+import codecs
+import json
+import os
+
+
+class JSONStream:
+    """
+    Reads JSON values from a file one at a time, keeping only a small window
+    of the file in memory
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """ Reads the next chunk of the file, returns False at the end """
+        if self._eof:
+            return False
+
+        chunk = self.fp.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        self._eof = len(chunk) == 0
+
+        # Drop what has already been parsed
+        self._buffer = self._buffer[self._pos:] + \
+            self._text.decode(chunk, final=self._eof)
+        self._pos = 0
+
+        return not self._eof
+
+    def peek(self):
+        """ Returns the next non whitespace character """
+        while True:
+            while self._pos < len(self._buffer) and \
+                    self._buffer[self._pos].isspace():
+                self._pos += 1
+
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON file")
+
+    def expect(self, characters):
+        """ Consumes the next character, which must be one of characters """
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(f"Expected {characters!r} near byte "
+                             f"{self.bytes_read} but found {character!r}")
+        self._pos += 1
+        return character
+
+    def decode(self):
+        """ Decodes the next value """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer could continue
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+
+            self._fill()
+
+    def iter_array(self):
+        """ Yields the values of the next array """
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_coco_sections(fp, sections, chunk_size=JSONStream.CHUNK_SIZE):
+    """
+    Streams the items of top level arrays of a coco file (e.g. images)
+    without loading the whole file. Other sections are skipped.
+
+    :param fp: coco file opened in binary mode
+    :param sections: names of the arrays to read
+    :param chunk_size: number of bytes read at once
+    :return: generator of (section, item)
+    """
+    stream = JSONStream(fp, chunk_size)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+
+    while True:
+        section = stream.decode()
+        stream.expect(':')
+
+        if stream.peek() == '[':
+            for item in stream.iter_array():
+                if section in sections:
+                    yield section, item
+        else:
+            stream.decode()
+
+        if stream.expect(',}') == '}':
+            return
+
+
+def coco_file_sections(path, sections):
+    """
+    Opens a coco file and streams the items of the given sections
+
+    :param path: path of the coco file
+    :param sections: names of the arrays to read
+    :return: generator of (section, item, fraction of the file read)
+    """
+    size = max(os.path.getsize(path), 1)
+
+    with open(path, 'rb') as fp:
+        items = iter_coco_sections(fp, sections)
+        for section, item in items:
+            yield section, item, fp.tell() / size
+
+
+class ChunkWriter:
+    """
+    Splits the annotations of an import into chunk files of about chunk_size
+    annotations, one JSON record per line. All annotations of an image go to
+    the same chunk, so chunks can be imported in parallel without racing on
+    duplicates or image counters.
+    """
+
+    def __init__(self, directory, chunk_size, buffer_size=1000):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+
+        self._counts = []
+        self._chunk_of_image = {}
+        self._buffers = {}
+
+    @staticmethod
+    def chunk_path(directory, chunk):
+        return os.path.join(directory, f"chunk-{chunk:05d}.jsonl")
+
+    @property
+    def chunks(self):
+        return len(self._counts)
+
+    def write(self, image, category_id, annotation):
+        """
+        :param image: image dictionary with id, width and height
+        :param category_id: database id of the category
+        :param annotation: annotation in coco format
+        """
+        chunk = self._chunk_of_image.get(image['id'])
+        if chunk is None:
+            if self.chunks == 0 or self._counts[-1] >= self.chunk_size:
+                self._counts.append(0)
+            chunk = self.chunks - 1
+            self._chunk_of_image[image['id']] = chunk
+
+        self._counts[chunk] += 1
+
+        buffer = self._buffers.setdefault(chunk, [])
+        buffer.append(json.dumps([image, category_id, annotation]))
+        if len(buffer) >= self.buffer_size:
+            self._flush(chunk)
+
+    def _flush(self, chunk):
+        buffer = self._buffers.pop(chunk, [])
+        if len(buffer) == 0:
+            return
+
+        with open(self.chunk_path(self.directory, chunk), 'a') as fp:
+            fp.write('\n'.join(buffer) + '\n')
+
+    def close(self):
+        for chunk in list(self._buffers):
+            self._flush(chunk)
+
+
+def read_chunk(directory, chunk):
+    """
+    Reads a chunk file written by ChunkWriter
+
+    :return: list of (image, category_id, annotation)
+    """
+    with open(ChunkWriter.chunk_path(directory, chunk)) as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def _normalize(value):
+    """ Converts numbers to floats so 1 and 1.0 are hashed the same """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def annotation_key(image_id, category_id, segmentation, keypoints):
+    """
+    Returns a hash identifying an annotation by its image, category and shape,
+    used to detect duplicates during imports
+
+    :return: hex digest
+    """
+    data = [image_id, category_id, _normalize(segmentation or []),
+            _normalize(keypoints or [])]
+    text = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class AnnotationImporter:
+    """
+    Inserts the annotations of an import in bulk.
+
+    Existing annotations of the dataset (or of the given images) are loaded
+    once, so duplicates are detected in memory instead of querying for every
+    imported annotation. New annotations are buffered and inserted with
+    insert_many once batch_size of them are pending.
+    """
+
+    def __init__(self, dataset, batch_size=1000, image_ids=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.metadata = dataset.default_annotation_metadata.copy()
+
+        self.created = 0
+        self.duplicates = 0
+
+        self._pending = []
+        self._restore = {True: [], False: []}
+        self._existing = self._load_existing(image_ids)
+
+    def _load_existing(self, image_ids=None):
+        query = {'dataset_id': self.dataset.id}
+        if image_ids is not None:
+            query['image_id'] = {'$in': list(image_ids)}
+
+        collection = AnnotationModel._get_collection()
+        cursor = collection.find(
+            query,
+            {'image_id': 1, 'category_id': 1, 'segmentation': 1, 'keypoints': 1}
+        )
+
+        existing = {}
+        for annotation in cursor:
+            key = annotation_key(
+                annotation.get('image_id'),
+                annotation.get('category_id'),
+                annotation.get('segmentation'),
+                annotation.get('keypoints')
+            )
+            existing.setdefault(key, annotation['_id'])
+
+        return existing
+
+    def add(self, image, category_id, annotation):
+        """
+        Queues a coco annotation to be inserted
+
+        :param image: image dictionary with id, width and height
+        :param category_id: database id of the category
+        :param annotation: annotation in coco format
+        :return: True if the annotation is new, False if it already existed
+        """
+        segmentation = annotation.get('segmentation', [])
+        keypoints = annotation.get('keypoints', [])
+        isbbox = annotation.get('isbbox', False)
+
+        image_id = image['id']
+
+        key = annotation_key(image_id, category_id, segmentation, keypoints)
+        if key in self._existing:
+            annotation_id = self._existing[key]
+            if annotation_id is not None:
+                self._restore[bool(isbbox)].append(annotation_id)
+            self.duplicates += 1
+            return False
+
+        has_segmentation = len(segmentation) > 0
+        has_keypoints = len(keypoints) > 0
+
+        self._pending.append({
+            'image_id': image_id,
+            'category_id': category_id,
+            'dataset_id': self.dataset.id,
+            'width': image['width'],
+            'height': image['height'],
+            'segmentation': segmentation if has_segmentation else [],
+            'area': int(annotation.get('area', 0)) if has_segmentation else 0,
+            'bbox': annotation.get('bbox', [0, 0, 0, 0])
+                if has_segmentation else [0, 0, 0, 0],
+            'iscrowd': False,
+            'isbbox': isbbox,
+            'keypoints': keypoints if has_keypoints else [],
+            'color': annotation.get('color') or im.Color.random().hex,
+            'metadata': self.metadata.copy(),
+            'creator': 'system',
+            'deleted': False,
+            'milliseconds': 0,
+            'paper_object': [],
+            'events': []
+        })
+        # Duplicates within the same file only create one annotation. The id
+        # is not known until the batch is inserted, and a new annotation does
+        # not need to be restored
+        self._existing[key] = None
+
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+        return True
+
+    def flush(self):
+        """
+        Inserts pending annotations and restores duplicates that were deleted
+        """
+        if len(self._pending) > 0:
+            now = datetime.datetime.utcnow()
+            ids = reserve_ids(AnnotationModel, len(self._pending))
+            for annotation_id, annotation in zip(ids, self._pending):
+                annotation['_id'] = annotation_id
+                annotation['updated_at'] = now
+
+            collection = AnnotationModel._get_collection()
+            collection.insert_many(self._pending, ordered=False)
+
+            self.created += len(self._pending)
+            self._pending = []
+
+            # Bulk inserts skip TrackedDocument, so the dataset is bumped here
+            self.dataset.update(inc__version=1)
+
+        for isbbox, ids in self._restore.items():
+            if len(ids) == 0:
+                continue
+            AnnotationModel.objects(id__in=ids) \
+                .update(set__deleted=False, set__isbbox=isbbox)
+            self._restore[isbbox] = []
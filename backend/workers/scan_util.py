@@ -0,0 +1,150 @@
+from database import ImageModel
+from PIL import Image
+
+import contextlib
+import threading
+import json
+import os
+
+
+# Serializes changes of Pillow's decompression bomb limit
+_limit_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def pixel_limit_lifted():
+    """
+    Lifts Pillow's decompression bomb limit while opening images which are
+    never decoded at once, and restores it afterwards
+    """
+    with _limit_lock:
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+def probe_image(path):
+    """
+    Reads the size of an image from its header, without decoding it. Images
+    above Pillow's decompression bomb limit are read too, they are only
+    decoded as tiles.
+
+    :return: (width, height) or None if the file is not a readable image
+    """
+    try:
+        try:
+            with Image.open(path) as image:
+                return image.size
+        except Image.DecompressionBombError:
+            pass
+
+        # Only the header is read, so the limit is lifted for this file
+        with pixel_limit_lifted(), Image.open(path) as image:
+            return image.size
+    except (OSError, ValueError, SyntaxError):
+        return None
+
+
+class ScanManifest:
+    """
+    Modification times and subdirectories of every directory of a dataset
+    seen by the last scan. A directory's mtime changes when files are added,
+    removed or renamed in it, so directories with the same mtime do not need
+    to be listed again.
+    """
+
+    # Kept in a hidden directory, so saving it does not change the mtime of
+    # the dataset's directory
+    FILE_NAME = os.path.join('.scan', 'manifest.json')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILE_NAME)
+        self.entries = {}
+        self.listed = 0
+
+        # Entries of the directories seen by the current scan
+        self._seen = {}
+        # Directories listed again by the next scan
+        self._retry = set()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                self.entries = json.load(fp)
+        except (OSError, ValueError):
+            self.entries = {}
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        for relative in self._retry:
+            if relative in self._seen:
+                self._seen[relative]['mtime'] = None
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as fp:
+            json.dump(self._seen, fp)
+        os.replace(tmp_path, self.path)
+
+    def walk(self, full=False):
+        """
+        Yields the image files of directories which changed since the last
+        scan. Hidden directories are not scanned.
+
+        :param full: list every directory, even unchanged ones
+        :return: generator of (path, number of directories visited)
+        """
+        stack = ['']
+        while len(stack) > 0:
+            relative = stack.pop()
+            root = os.path.join(self.directory, relative)
+
+            try:
+                mtime = os.stat(root).st_mtime_ns
+            except OSError:
+                continue
+
+            entry = self.entries.get(relative)
+            if not full and entry is not None and entry['mtime'] == mtime:
+                self._seen[relative] = entry
+                stack.extend(os.path.join(relative, d) for d in entry['dirs'])
+                continue
+
+            dirs = []
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            self.listed += 1
+
+            for item in entries:
+                # Symbolic links to directories are not followed, so links
+                # pointing back up the tree are not scanned over and over
+                if item.is_dir(follow_symlinks=False):
+                    if not item.name.startswith('.'):
+                        dirs.append(item.name)
+                elif item.name.endswith(ImageModel.PATTERN):
+                    yield item.path, len(self._seen)
+
+            self._seen[relative] = {'mtime': mtime, 'dirs': dirs}
+            stack.extend(os.path.join(relative, d) for d in dirs)
+
+    def retry(self, path):
+        """
+        Lists the directory of a file again on the next scan, even if it
+        did not change, e.g. when the file could not be read yet
+        """
+        relative = os.path.relpath(os.path.dirname(path), self.directory)
+        if relative == '.':
+            relative = ''
+
+        self._retry.add(relative)
+
+    @property
+    def visited(self):
+        return len(self._seen)
@@ -2,4 +2,5 @@
 from .data import *
 from .test import *
 from .scan import *
-from .thumbnails import *
\ No newline at end of file
+from .thumbnails import *
+from .tiles import *
@@ -1,4 +1,5 @@
 
+from config import Config
 from database import (
     fix_ids,
     ImageModel,
@@ -10,18 +11,214 @@ from database import (
 )
 
 # import pycocotools.mask as mask
-import numpy as np
+import datetime
+import tempfile
+import zipfile
+import shutil
+import math
 import time
 import json
 import os
 
-from celery import shared_task
+from celery import shared_task, chord
 from ..socket import create_socket
+from ..import_util import (
+    AnnotationImporter,
+    ChunkWriter,
+    coco_file_sections,
+    read_chunk
+)
+from ..export_util import (
+    CocoWriter,
+    CocoPartWriter,
+    ParquetTableWriter,
+    RLEEncoder,
+    export_encoding,
+    open_export,
+    format_category,
+    format_annotation,
+    iter_export_records,
+    iter_image_annotations,
+    parquet_schemas
+)
 from mongoengine import Q
 
 
+def _export_queries(dataset, categories):
+    db_categories = CategoryModel.objects(id__in=categories, deleted=False) \
+        .only(*CategoryModel.COCO_PROPERTIES)
+    db_images = ImageModel.objects(
+        deleted=False, dataset_id=dataset.id).only(
+        *ImageModel.COCO_PROPERTIES)
+    db_annotations = AnnotationModel.objects(
+        deleted=False, dataset_id=dataset.id, category_id__in=categories)\
+        .only(*AnnotationModel.COCO_PROPERTIES)
+
+    return db_categories, db_images, db_annotations
+
+
+def _export_file_path(dataset, style="COCO"):
+    timestamp = time.time()
+    directory = f"{dataset.directory}.exports/"
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    if style == "PARQUET":
+        return f"{directory}parquet-{timestamp}.zip"
+
+    extension = ExportModel.ENCODINGS.get(_export_encoding(), '')
+    return f"{directory}coco-{timestamp}.json{extension}"
+
+
+def _export_encoding():
+    return export_encoding(Config.EXPORT_COMPRESSION)
+
+
+def _coco_writer(file_path):
+    return CocoWriter(file_path, _export_encoding(),
+                      Config.EXPORT_COMPRESSION_LEVEL)
+
+
+def _export_categories(task, writer, db_categories, on_progress):
+
+    # iterate though all categoires and upsert
+    category_names = []
+    for category in db_categories:
+        category = format_category(fix_ids(category))
+
+        task.info(f"Adding category: {category.get('name')}")
+        writer.write_category(category)
+        category_names.append(category.get('name'))
+
+        on_progress()
+
+    return category_names
+
+
+def _export_images(task, writer, db_images, db_annotations, on_progress,
+                   mask_format="polygon", processes=None):
+
+    # Documents are written out as soon as they are read, so the
+    # querysets must not cache them
+    db_images = db_images.order_by('id').no_cache()
+    db_annotations = db_annotations.order_by('image_id', 'id').no_cache()
+
+    encoder = None
+    if mask_format == "rle":
+        encoder = RLEEncoder(processes or Config.EXPORT_PROCESSES)
+
+    batch = []
+    batch_size = 0
+
+    try:
+        pairs = iter_image_annotations(db_images, db_annotations)
+        for image, annotations in pairs:
+            image = fix_ids(image)
+            on_progress()
+
+            # Images without annotations are left out of the export
+            if len(annotations) == 0:
+                continue
+
+            annotations = [format_annotation(fix_ids(a)) for a in annotations]
+            annotations = [a for a in annotations if a is not None]
+
+            batch.append((image, annotations))
+            batch_size += len(annotations)
+
+            if batch_size >= Config.EXPORT_BATCH_SIZE:
+                _write_batch(task, writer, batch, encoder)
+                batch = []
+                batch_size = 0
+
+        _write_batch(task, writer, batch, encoder)
+
+    finally:
+        if encoder is not None:
+            encoder.close()
+
+    if encoder is not None:
+        task.info(encoder.summary())
+
+
+def _write_batch(task, writer, batch, encoder):
+
+    if encoder is not None and len(batch) > 0:
+        for annotation, error in encoder.encode(batch):
+            task.warning(f"Annotation {annotation.get('id')} is exported as "
+                         f"polygons, it could not be encoded as RLE: {error}")
+
+    for image, annotations in batch:
+        for annotation in annotations:
+            writer.write_annotation(annotation)
+
+        task.info(
+            f"Exporting {len(annotations)} annotations for image {image.get('id')}")
+        writer.write_image(image)
+
+
+def _copy_unchanged(writer, path, encoding, changed, existing):
+    """
+    Copies the images and annotations of a previous export which do not
+    belong to any of the changed images, nor to images removed since
+
+    :param existing: ids of the images still in the dataset
+    """
+    kept = 0
+    with open_export(path, 'r', encoding) as fp:
+        for section, record in iter_export_records(fp):
+
+            if section == 'images':
+                image_id = json.loads(record).get('id')
+                if image_id in changed or image_id not in existing:
+                    continue
+                kept += 1
+            elif section == 'annotations':
+                image_id = json.loads(record).get('image_id')
+                if image_id in changed or image_id not in existing:
+                    continue
+            else:
+                continue
+
+            writer.write_raw(section, record)
+
+    return kept
+
+
+def _create_export(task, dataset, file_path, category_names, categories,
+                   snapshot_at, version, mask_format="polygon", base=None,
+                   style="COCO"):
+
+    task.info("Creating export object")
+    export = ExportModel(
+        dataset_id=dataset.id,
+        path=file_path,
+        tags=[style, *(["RLE"] if mask_format == "rle" else []),
+              *category_names],
+        categories=sorted(categories),
+        mask_format=mask_format,
+        snapshot_at=snapshot_at,
+        dataset_version=version,
+        base_id=base.id if base else None
+    )
+    export.save()
+
+    size = os.path.getsize(file_path)
+    task.info(f"Export file size: {size} bytes")
+
+    evicted = ExportModel.evict(
+        datetime.timedelta(days=Config.EXPORT_CACHE_MAX_AGE),
+        Config.EXPORT_CACHE_MAX_SIZE
+    )
+    if evicted > 0:
+        task.info(f"Removed {evicted} old export(s)")
+
+    return export
+
+
 @shared_task
-def export_annotations(task_id, dataset_id, categories):
+def export_annotations(task_id, dataset_id, categories, mask_format="polygon"):
 
     task = TaskModel.objects.get(id=task_id)
     dataset = DatasetModel.objects.get(id=dataset_id)
@@ -31,144 +228,463 @@ def export_annotations(task_id, dataset_id, categories):
 
     task.info("Beginning Export (COCO Format)")
 
-    db_categories = CategoryModel.objects(id__in=categories, deleted=False) \
-        .only(*CategoryModel.COCO_PROPERTIES)
-    db_images = ImageModel.objects(
-        deleted=False, dataset_id=dataset.id).only(
-        *ImageModel.COCO_PROPERTIES)
-    db_annotations = AnnotationModel.objects(
-        deleted=False, category_id__in=categories)
+    snapshot_at = datetime.datetime.utcnow()
+    db_categories, db_images, db_annotations = \
+        _export_queries(dataset, categories)
 
     total_items = db_categories.count()
-
-    coco = {
-        'images': [],
-        'categories': [],
-        'annotations': []
-    }
-
     total_items += db_images.count()
     progress = 0
 
-    # iterate though all categoires and upsert
-    category_names = []
-    for category in fix_ids(db_categories):
+    def on_progress():
+        nonlocal progress
+        progress += 1
+        task.set_progress((progress / total_items) * 100, socket=socket)
 
-        if len(category.get('keypoint_labels', [])) > 0:
-            category['keypoints'] = category.pop('keypoint_labels', [])
-            category['skeleton'] = category.pop('keypoint_edges', [])
-        else:
-            if 'keypoint_edges' in category:
-                del category['keypoint_edges']
-            if 'keypoint_labels' in category:
-                del category['keypoint_labels']
+    file_path = _export_file_path(dataset)
 
-        task.info(f"Adding category: {category.get('name')}")
-        coco.get('categories').append(category)
-        category_names.append(category.get('name'))
+    task.info(f"Writing export to file {file_path}")
+    with _coco_writer(file_path) as writer:
+        category_names = _export_categories(
+            task, writer, db_categories, on_progress)
+        _export_images(task, writer, db_images, db_annotations, on_progress,
+                       mask_format)
+
+        total_annotations = writer.count('annotations')
+        total_images = writer.count('images')
+
+    task.info(
+        f"Done export {total_annotations} annotations and {total_images} images from {dataset.name}")
+
+    _create_export(task, dataset, file_path, category_names, categories,
+                   snapshot_at, dataset.version, mask_format)
+
+    task.set_progress(100, socket=socket)
 
+
+@shared_task
+def export_annotations_delta(task_id, dataset_id, categories, base_id,
+                             mask_format="polygon"):
+
+    task = TaskModel.objects.get(id=task_id)
+    dataset = DatasetModel.objects.get(id=dataset_id)
+    base = ExportModel.objects.get(id=base_id)
+
+    task.update(status="PROGRESS")
+    socket = create_socket()
+
+    task.info(f"Beginning Export (COCO Format, changes since export {base.id})")
+
+    snapshot_at = datetime.datetime.utcnow()
+    db_categories, db_images, db_annotations = \
+        _export_queries(dataset, categories)
+
+    # Images which were modified, or had annotations modified, since the
+    # previous export are read again. Everything else is copied over.
+    changed = set(ImageModel.objects(
+        dataset_id=dataset.id, updated_at__gte=base.snapshot_at
+    ).distinct('id'))
+    changed.update(AnnotationModel.objects(
+        dataset_id=dataset.id, updated_at__gte=base.snapshot_at
+    ).distinct('image_id'))
+
+    task.info(f"Found {len(changed)} changed images")
+
+    # Images deleted from the database leave no trace behind, so the
+    # images of the previous export are checked against the dataset
+    existing = {image['_id'] for image in ImageModel._get_collection().find(
+        {'dataset_id': dataset.id, 'deleted': False}, {'_id': 1})}
+
+    total_items = db_categories.count() + len(changed) + 1
+    progress = 0
+
+    def on_progress():
+        nonlocal progress
         progress += 1
         task.set_progress((progress / total_items) * 100, socket=socket)
 
-    total_annotations = db_annotations.count()
-    total_images = db_images.count()
-    for image in db_images:
-        image = fix_ids(image)
+    file_path = _export_file_path(dataset)
+
+    task.info(f"Writing export to file {file_path}")
+    with _coco_writer(file_path) as writer:
+        category_names = _export_categories(
+            task, writer, db_categories, on_progress)
+
+        kept = _copy_unchanged(writer, base.path, base.encoding, changed,
+                               existing)
+        task.info(f"Copied {kept} unchanged images from export {base.id}")
+        on_progress()
+
+        changed = list(changed)
+        _export_images(
+            task, writer,
+            db_images.filter(id__in=changed),
+            db_annotations.filter(image_id__in=changed),
+            on_progress,
+            mask_format
+        )
+
+        total_annotations = writer.count('annotations')
+        total_images = writer.count('images')
+
+    task.info(
+        f"Done export {total_annotations} annotations and {total_images} images from {dataset.name}")
+
+    _create_export(task, dataset, file_path, category_names, categories,
+                   snapshot_at, dataset.version, mask_format, base=base)
+
+    task.set_progress(100, socket=socket)
+
+
+@shared_task
+def export_annotations_sharded(task_id, dataset_id, categories, shards,
+                               mask_format="polygon"):
+
+    task = TaskModel.objects.get(id=task_id)
+    dataset = DatasetModel.objects.get(id=dataset_id)
+
+    task.update(status="PROGRESS")
+
+    task.info(f"Beginning Export (COCO Format, {shards} shards)")
+
+    db_images = ImageModel.objects(deleted=False, dataset_id=dataset.id)\
+        .only('id')
+    first = db_images.order_by('id').first()
+    last = db_images.order_by('-id').first()
+
+    directory = f"{dataset.directory}.exports/.shards-{task.id}/"
+    os.makedirs(directory, exist_ok=True)
+
+    ranges = []
+    if first is not None:
+        step = math.ceil((last.id - first.id + 1) / shards)
+        ranges = [
+            (first.id + step * i, min(first.id + step * (i + 1), last.id + 1))
+            for i in range(shards)
+            if first.id + step * i <= last.id
+        ]
+
+    task.update(
+        set__metadata__shards={},
+        set__metadata__num_shards=len(ranges),
+        set__metadata__snapshot_at=datetime.datetime.utcnow(),
+        set__metadata__dataset_version=dataset.version
+    )
+
+    subtasks = [
+        export_annotations_shard.s(
+            task.id, dataset.id, categories, shard, start, stop, directory,
+            mask_format)
+        for shard, (start, stop) in enumerate(ranges)
+    ]
+    merge = export_annotations_merge.s(
+        task.id, dataset.id, categories, directory, mask_format)
+    # Runs instead of the merge when a shard fails
+    merge.link_error(export_annotations_failed.s(
+        task_id=task.id, directory=directory))
+
+    task.info(f"Splitting image ids into {len(ranges)} shards")
+    if len(subtasks) == 0:
+        merge.delay([])
+    else:
+        chord(subtasks)(merge)
 
+
+@shared_task
+def export_annotations_shard(task_id, dataset_id, categories, shard,
+                             start, stop, directory, mask_format="polygon"):
+
+    task = TaskModel.objects.get(id=task_id)
+    dataset = DatasetModel.objects.get(id=dataset_id)
+    socket = create_socket()
+
+    _, db_images, db_annotations = _export_queries(dataset, categories)
+    db_images = db_images.filter(id__gte=start, id__lt=stop)
+    db_annotations = db_annotations.filter(
+        image_id__gte=start, image_id__lt=stop)
+
+    total_items = max(db_images.count(), 1)
+    progress = 0
+
+    def on_progress():
+        nonlocal progress
         progress += 1
-        task.set_progress((progress / total_items) * 100, socket=socket)
+        task.set_shard_progress(
+            shard, (progress / total_items) * 100, socket=socket)
 
-        annotations = db_annotations.filter(image_id=image.get('id'))\
-            .only(*AnnotationModel.COCO_PROPERTIES)
-        annotations = fix_ids(annotations)
+    task.info(f"Exporting shard {shard} (image ids {start} to {stop - 1})")
+    # Shards already run in parallel, so each one encodes in its own process
+    with CocoPartWriter(directory, shard) as writer:
+        _export_images(task, writer, db_images, db_annotations, on_progress,
+                       mask_format, processes=1)
 
-        if len(annotations) == 0:
-            continue
+    task.set_shard_progress(shard, 100, socket=socket)
 
-        num_annotations = 0
-        for annotation in annotations:
+    return {
+        'shard': shard,
+        'images': writer.count('images'),
+        'annotations': writer.count('annotations')
+    }
+
+
+@shared_task
+def export_annotations_merge(results, task_id, dataset_id, categories,
+                             directory, mask_format="polygon"):
+
+    task = TaskModel.objects.get(id=task_id)
+    dataset = DatasetModel.objects.get(id=dataset_id)
+    socket = create_socket()
 
-            has_keypoints = len(annotation.get('keypoints', [])) > 0
-            has_segmentation = len(annotation.get('segmentation', [])) > 0
+    db_categories, _, _ = _export_queries(dataset, categories)
+    file_path = _export_file_path(dataset)
 
-            if has_keypoints or has_segmentation:
+    task.info(f"Merging {len(results)} shards into {file_path}")
+    with _coco_writer(file_path) as writer:
+        category_names = _export_categories(
+            task, writer, db_categories, lambda: None)
 
-                if not has_keypoints:
-                    if 'keypoints' in annotation:
-                        del annotation['keypoints']
-                else:
-                    arr = np.array(annotation.get('keypoints', []))
-                    arr = arr[2::3]
-                    annotation['num_keypoints'] = len(arr[arr > 0])
+        for result in sorted(results, key=lambda r: r['shard']):
+            for section in ('images', 'annotations'):
+                writer.append_part(
+                    section,
+                    CocoPartWriter.part_path(directory, result['shard'], section),
+                    result[section]
+                )
 
-                num_annotations += 1
-                coco.get('annotations').append(annotation)
+        total_annotations = writer.count('annotations')
+        total_images = writer.count('images')
 
-        task.info(
-            f"Exporting {num_annotations} annotations for image {image.get('id')}")
-        coco.get('images').append(image)
+    shutil.rmtree(directory, ignore_errors=True)
 
     task.info(
         f"Done export {total_annotations} annotations and {total_images} images from {dataset.name}")
 
-    timestamp = time.time()
-    directory = f"{dataset.directory}.exports/"
-    file_path = f"{directory}coco-{timestamp}.json"
+    _create_export(task, dataset, file_path, category_names, categories,
+                   task.metadata.get('snapshot_at'),
+                   task.metadata.get('dataset_version'), mask_format)
 
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    task.set_progress(100, socket=socket)
+
+
+@shared_task
+def export_annotations_failed(*args, task_id, directory):
+    """
+    Error callback of a sharded export. Celery passes either the id of the
+    merge task, or the request, exception and traceback, which are not used.
+    """
+
+    task = TaskModel.objects.get(id=task_id)
+    _fail_task(task, "Export failed, a shard could not be exported")
+
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def _fail_task(task, message):
+    task.error(message)
+    task.flush_logs()
+    task.update(status="FAILED", failed=True)
+
+
+def _parquet_row(table, row):
+
+    row['id'] = row.pop('_id')
+
+    if table == 'annotations':
+        keypoints = row.pop('keypoints', [])
+        row['num_keypoints'] = sum(1 for v in keypoints[2::3] if v > 0)
+
+    return row
+
+
+@shared_task
+def export_parquet(task_id, dataset_id, categories):
+
+    task = TaskModel.objects.get(id=task_id)
+    dataset = DatasetModel.objects.get(id=dataset_id)
+
+    task.update(status="PROGRESS")
+    socket = create_socket()
+
+    task.info("Beginning Export (Parquet Format)")
+
+    snapshot_at = datetime.datetime.utcnow()
+
+    # Columnar exports only hold the fields used for statistics, so
+    # segmentation is never loaded
+    db_categories = CategoryModel.objects(id__in=categories, deleted=False) \
+        .only('id', 'name', 'supercategory', 'color')
+    db_images = ImageModel.objects(deleted=False, dataset_id=dataset.id) \
+        .only('id', 'dataset_id', 'file_name', 'path', 'width', 'height',
+              'num_annotations', 'date_captured')
+    # Annotations of deleted images are left out like their images
+    deleted_images = ImageModel.objects(deleted=True, dataset_id=dataset.id) \
+        .distinct('id')
+    db_annotations = AnnotationModel.objects(
+        Q(segmentation__not__size=0) | Q(keypoints__not__size=0),
+        deleted=False, dataset_id=dataset.id, category_id__in=categories,
+        image_id__nin=deleted_images) \
+        .only('id', 'image_id', 'category_id', 'area', 'bbox', 'iscrowd',
+              'isbbox', 'keypoints')
+
+    cursors = [
+        ('categories', db_categories),
+        ('images', db_images.order_by('id')),
+        ('annotations', db_annotations.order_by('image_id', 'id'))
+    ]
+
+    total_items = sum(cursor.count() for _, cursor in cursors)
+    progress = 0
+
+    file_path = _export_file_path(dataset, style="PARQUET")
+    directory = os.path.dirname(file_path)
+
+    schemas = parquet_schemas()
+    category_names = []
 
     task.info(f"Writing export to file {file_path}")
-    with open(file_path, 'w') as fp:
-        json.dump(coco, fp)
+    with tempfile.TemporaryDirectory(dir=directory) as tables_directory:
 
-    task.info("Creating export object")
-    export = ExportModel(dataset_id=dataset.id, path=file_path, tags=[
-                         "COCO", *category_names])
-    export.save()
+        table_paths = []
+        for table, cursor in cursors:
+            table_path = os.path.join(tables_directory, f"{table}.parquet")
+            table_paths.append(table_path)
+
+            with ParquetTableWriter(table_path, schemas[table],
+                                    Config.EXPORT_PARQUET_BATCH_SIZE) as writer:
+                for row in cursor.no_cache().as_pymongo():
+                    row = _parquet_row(table, row)
+                    writer.write(row)
+
+                    if table == 'categories':
+                        category_names.append(row.get('name'))
+
+                    progress += 1
+                    task.set_progress((progress / total_items) * 100, socket=socket)
+
+            task.info(f"Wrote {writer.count} rows to {table}.parquet")
+
+        # Parquet files are already compressed, so they are only stored
+        with zipfile.ZipFile(f"{file_path}.tmp", 'w', zipfile.ZIP_STORED) as archive:
+            for table_path in table_paths:
+                archive.write(table_path, os.path.basename(table_path))
+
+        os.replace(f"{file_path}.tmp", file_path)
+
+    _create_export(task, dataset, file_path, category_names, categories,
+                   snapshot_at, dataset.version, style="PARQUET")
 
     task.set_progress(100, socket=socket)
 
 
-@shared_task
-def import_annotations(task_id, dataset_id, coco_json):
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def import_annotations(task_id, dataset_id, coco_path):
+    """
+    Splits the annotations of a coco file into chunks which are imported in
+    parallel. Finished chunks are recorded in the task's metadata, so a
+    restarted import only runs the chunks which are not done.
+    """
 
     task = TaskModel.objects.get(id=task_id)
     dataset = DatasetModel.objects.get(id=dataset_id)
 
+    if task.completed:
+        return
+
     task.update(status="PROGRESS")
     socket = create_socket()
 
-    task.info("Beginning Import")
+    directory = f"{dataset.directory}.imports/{task.id}/"
+    num_chunks = task.metadata.get('chunks')
 
-    images = ImageModel.objects(dataset_id=dataset.id)
-    categories = CategoryModel.objects
+    if num_chunks is None or not os.path.exists(directory):
+        task.info("Beginning Import")
+
+        # Remove chunks of an interrupted split
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
 
-    coco_images = coco_json.get('images', [])
-    coco_annotations = coco_json.get('annotations', [])
-    coco_categories = coco_json.get('categories', [])
+        try:
+            num_chunks = _split_coco_file(task, dataset, coco_path, directory, socket)
+        except ValueError as e:
+            _fail_task(task, f"Could not read coco file: {e}")
+            _remove_import(coco_path, directory)
+            return
+
+        task.update(set__metadata__chunks=num_chunks, set__metadata__done={})
+        task.reload()
+    else:
+        done = len(task.metadata.get('done', {}))
+        task.info(f"Resuming Import ({done} of {num_chunks} chunks done)")
+
+    # A redelivered message must not dispatch the chunks a second time, so
+    # the dispatch is recorded before the chunks are sent
+    dispatched = TaskModel.objects(id=task.id, metadata__dispatched__ne=True) \
+        .modify(set__metadata__dispatched=True)
+    if dispatched is None:
+        task.info("Chunks were already dispatched")
+        return
+
+    done = task.metadata.get('done', {})
+    subtasks = [
+        import_annotations_chunk.si(task.id, dataset.id, directory, chunk)
+        for chunk in range(num_chunks) if str(chunk) not in done
+    ]
+    finish = import_annotations_finish.s(task.id, dataset.id, coco_path, directory)
+    # Runs instead of finish when a chunk fails
+    finish.link_error(import_annotations_failed.s(
+        task_id=task.id, coco_path=coco_path, directory=directory))
+
+    task.info(f"Importing {len(subtasks)} chunks")
+    if len(subtasks) == 0:
+        finish.delay([])
+    else:
+        chord(subtasks)(finish)
+
+
+def _split_coco_file(task, dataset, coco_path, directory, socket):
+    """
+    Reads categories and images from a coco file, then writes its annotations
+    (with database ids) into chunk files. Progress is based on the position
+    in the file, a quarter for each pass.
+
+    :return: number of chunks
+    """
+
+    task.info("===== Reading Categories and Images =====")
+    coco_categories = []
+    coco_images = []
+
+    sections = coco_file_sections(coco_path, ('categories', 'images'))
+    for count, (section, item, read) in enumerate(sections, 1):
+        if section == 'categories':
+            coco_categories.append(item)
+        else:
+            coco_images.append({
+                'id': item.get('id'),
+                'file_name': item.get('file_name')
+            })
 
-    task.info(f"Importing {len(coco_categories)} categories, "
-              f"{len(coco_images)} images, and "
-              f"{len(coco_annotations)} annotations")
+        if count % Config.IMPORT_BATCH_SIZE == 0:
+            task.set_progress(read * 25, socket=socket)
 
-    total_items = sum([
-        len(coco_categories),
-        len(coco_annotations),
-        len(coco_images)
-    ])
-    progress = 0
+    task.info(f"Importing {len(coco_categories)} categories and "
+              f"{len(coco_images)} images")
 
     task.info("===== Importing Categories =====")
     # category id mapping  ( file : database )
     categories_id = {}
 
+    # Categories are matched by name without case
+    categories = {}
+    for category_model in CategoryModel.objects.only('id', 'name'):
+        categories.setdefault(category_model.name.lower(), category_model)
+
     # Create any missing categories
     for category in coco_categories:
 
         category_name = category.get('name')
         category_id = category.get('id')
-        category_model = categories.filter(name__iexact=category_name).first()
+        category_model = categories.get((category_name or "").lower())
 
         if category_model is None:
             task.warning(
@@ -182,33 +698,32 @@ def import_annotations(task_id, dataset_id, coco_json):
             new_category.save()
 
             category_model = new_category
+            categories[(category_name or "").lower()] = new_category
             dataset.categories.append(new_category.id)
 
         task.info(f"{category_name} category found")
         # map category ids
         categories_id[category_id] = category_model.id
 
-        # update progress
-        progress += 1
-        task.set_progress((progress / total_items) * 100, socket=socket)
-
     dataset.update(set__categories=dataset.categories)
 
     task.info("===== Loading Images =====")
     # image id mapping ( file: database )
     images_id = {}
-    categories_by_image = {}
+
+    images_by_name = {}
+    db_images = ImageModel.objects(dataset_id=dataset.id) \
+        .only('id', 'file_name', 'width', 'height')
+    for image_model in db_images:
+        images_by_name.setdefault(image_model.file_name, []) \
+            .append(image_model)
 
     # Find all images
     for image in coco_images:
         image_id = image.get('id')
         image_filename = image.get('file_name')
 
-        # update progress
-        progress += 1
-        task.set_progress((progress / total_items) * 100, socket=socket)
-
-        image_model = images.filter(file_name__exact=image_filename).all()
+        image_model = images_by_name.get(image_filename, [])
 
         if len(image_model) == 0:
             task.warning(f"Could not find image {image_filename}")
@@ -219,25 +734,28 @@ def import_annotations(task_id, dataset_id, coco_json):
                 f"Too many images found with the same file name: {image_filename}")
             continue
 
-        task.info(f"Image {image_filename} found")
         image_model = image_model[0]
-        images_id[image_id] = image_model
-        categories_by_image[image_id] = list()
+        images_id[image_id] = {
+            'id': image_model.id,
+            'width': image_model.width,
+            'height': image_model.height
+        }
+
+    task.info(f"Found {len(images_id)} of {len(coco_images)} images")
 
-    task.info("===== Import Annotations =====")
-    for annotation in coco_annotations:
+    task.info("===== Splitting Annotations =====")
+    writer = ChunkWriter(directory, Config.IMPORT_CHUNK_SIZE)
+
+    sections = coco_file_sections(coco_path, ('annotations',))
+    for count, (_, annotation, read) in enumerate(sections, 1):
 
         image_id = annotation.get('image_id')
         category_id = annotation.get('category_id')
         segmentation = annotation.get('segmentation', [])
         keypoints = annotation.get('keypoints', [])
-        # is_crowd = annotation.get('iscrowed', False)
-        area = annotation.get('area', 0)
-        bbox = annotation.get('bbox', [0, 0, 0, 0])
-        isbbox = annotation.get('isbbox', False)
 
-        progress += 1
-        task.set_progress((progress / total_items) * 100, socket=socket)
+        if count % Config.IMPORT_BATCH_SIZE == 0:
+            task.set_progress(25 + read * 25, socket=socket)
 
         has_segmentation = len(segmentation) > 0
         has_keypoints = len(keypoints) > 0
@@ -247,65 +765,122 @@ def import_annotations(task_id, dataset_id, coco_json):
             continue
 
         try:
-            image_model = images_id[image_id]
+            image = images_id[image_id]
             category_model_id = categories_id[category_id]
-            image_categories = categories_by_image[image_id]
         except KeyError:
             task.warning(
                 f"Could not find image assoicated with annotation {annotation.get('id')}")
             continue
 
-        annotation_model = AnnotationModel.objects(
-            image_id=image_model.id,
-            category_id=category_model_id,
-            segmentation=segmentation,
-            keypoints=keypoints
-        ).first()
+        writer.write(image, category_model_id, annotation)
+
+    writer.close()
+    task.info(f"Split annotations into {writer.chunks} chunks")
 
-        if annotation_model is None:
-            task.info(f"Creating annotation data ({image_id}, {category_id})")
+    return writer.chunks
 
-            annotation_model = AnnotationModel(image_id=image_model.id)
-            annotation_model.category_id = category_model_id
 
-            annotation_model.color = annotation.get('color')
-            annotation_model.metadata = annotation.get('metadata', {})
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def import_annotations_chunk(task_id, dataset_id, directory, chunk):
 
-            if has_segmentation:
-                annotation_model.segmentation = segmentation
-                annotation_model.area = area
-                annotation_model.bbox = bbox
+    task = TaskModel.objects.get(id=task_id)
+    dataset = DatasetModel.objects.get(id=dataset_id)
 
-            if has_keypoints:
-                annotation_model.keypoints = keypoints
+    if str(chunk) in task.metadata.get('done', {}):
+        return
 
-            annotation_model.isbbox = isbbox
-            annotation_model.save()
+    socket = create_socket()
+    started_at = time.time()
 
-            image_categories.append(category_id)
-        else:
-            annotation_model.update(deleted=False, isbbox=isbbox)
-            task.info(
-                f"Annotation already exists (i:{image_id}, c:{category_id})")
-
-    for image_id in images_id:
-        image_model = images_id[image_id]
-        category_ids = categories_by_image[image_id]
-        all_category_ids = list(image_model.category_ids)
-        all_category_ids += category_ids
-
-        num_annotations = AnnotationModel.objects(
-            Q(image_id=image_id) & Q(deleted=False) &
-            (Q(area__gt=0) | Q(keypoints__size__gt=0))
-        ).count()
-
-        image_model.update(
-            set__annotated=True,
-            set__category_ids=list(set(all_category_ids)),
-            set__num_annotations=num_annotations
-        )
+    records = read_chunk(directory, chunk)
+    image_ids = {image['id'] for image, _, _ in records}
+
+    importer = AnnotationImporter(
+        dataset,
+        batch_size=Config.IMPORT_BATCH_SIZE,
+        image_ids=image_ids
+    )
+    for image, category_id, annotation in records:
+        importer.add(image, category_id, annotation)
+    importer.flush()
+
+    # Checkpoint
+    task.modify(**{
+        f'set__metadata__done__{chunk}': [importer.created, importer.duplicates]
+    })
+
+    seconds = time.time() - started_at
+    task.info(f"Imported chunk {chunk}: created {importer.created} "
+              f"annotations, {importer.duplicates} already existed "
+              f"({seconds:.1f}s)")
+
+    done = len(task.metadata.get('done', {}))
+    num_chunks = max(task.metadata.get('chunks', 1), 1)
+    task.set_progress(min(50 + (done / num_chunks) * 50, 99), socket=socket)
+
+
+@shared_task
+def import_annotations_finish(results, task_id, dataset_id, coco_path, directory):
+
+    task = TaskModel.objects.get(id=task_id)
+    socket = create_socket()
+
+    done = task.metadata.get('done', {}).values()
+    created = sum(counts[0] for counts in done)
+    duplicates = sum(counts[1] for counts in done)
+    task.info(f"Created {created} annotations, {duplicates} already existed")
+
+    updated = ImageModel.reindex_counters(dataset_id)
+    task.info(f"Updated the counters of {updated} images")
+
+    _remove_import(coco_path, directory)
 
     task.set_progress(100, socket=socket)
 
 
-__all__ = ["export_annotations", "import_annotations"]
+@shared_task
+def import_annotations_failed(*args, task_id, coco_path, directory):
+    """
+    Error callback of an import. Celery passes either the id of the finish
+    task, or the request, exception and traceback, which are not used.
+    """
+
+    task = TaskModel.objects.get(id=task_id)
+    _fail_task(task, "Import failed, a chunk could not be imported")
+
+    _remove_import(coco_path, directory)
+
+
+@shared_task
+def reindex_dataset(task_id, dataset_id):
+
+    task = TaskModel.objects.get(id=task_id)
+    dataset = DatasetModel.objects.get(id=dataset_id)
+
+    task.update(status="PROGRESS")
+    socket = create_socket()
+
+    task.info(f"Recomputing annotation counters of {dataset.name}")
+    started_at = time.time()
+
+    updated = ImageModel.reindex_counters(dataset.id)
+
+    seconds = time.time() - started_at
+    task.info(f"Updated the counters of {updated} images ({seconds:.1f}s)")
+    task.set_progress(100, socket=socket)
+
+
+def _remove_import(coco_path, directory):
+    shutil.rmtree(directory, ignore_errors=True)
+    if os.path.exists(coco_path):
+        os.remove(coco_path)
+
+
+__all__ = ["export_annotations", "export_annotations_delta",
+           "export_annotations_sharded",
+           "export_annotations_shard", "export_annotations_merge",
+           "export_annotations_failed",
+           "export_parquet",
+           "import_annotations", "import_annotations_chunk",
+           "import_annotations_finish", "import_annotations_failed",
+           "reindex_dataset"]
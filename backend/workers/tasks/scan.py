@@ -1,18 +1,25 @@
+from config import Config
 from database import (
     ImageModel,
     TaskModel,
-    DatasetModel
+    DatasetModel,
+    reserve_ids
 )
 
 from celery import shared_task
+from concurrent.futures import ThreadPoolExecutor
+from pymongo.errors import BulkWriteError
 from ..socket import create_socket
-from .thumbnails import thumbnail_generate_single_image
+from ..scan_util import ScanManifest, probe_image
+from .thumbnails import thumbnail_generate_batches
 
+import datetime
+import time
 import os
 
 
 @shared_task
-def scan_dataset(task_id, dataset_id):
+def scan_dataset(task_id, dataset_id, full=False):
 
     task = TaskModel.objects.get(id=task_id)
     dataset = DatasetModel.objects.get(id=dataset_id)
@@ -21,42 +28,108 @@ def scan_dataset(task_id, dataset_id):
     socket = create_socket()
     
     directory = dataset.directory
-    toplevel = list(os.listdir(directory))
-    task.info(f"Scanning {directory}")
+    task.info(f"Scanning {directory}" + (" (full scan)" if full else ""))
+    started_at = time.time()
+
+    # Paths of the dataset's images are loaded once instead of querying
+    # for every file found
+    images = ImageModel._get_collection().find(
+        {'dataset_id': dataset.id}, {'path': 1, '_id': 0})
+    known = {image.get('path') for image in images}
+    task.info(f"Loaded {len(known)} known image(s)")
+
+    manifest = ScanManifest(directory).load()
+    # Progress is estimated from the number of directories of the last scan
+    expected = max(len(manifest.entries), 1)
 
     count = 0
-    for root, dirs, files in os.walk(directory):
+    found = 0
+    batch = []
 
-        try:
-            youarehere = toplevel.index(root.split('/')[-1])
-            progress = int(((youarehere)/len(toplevel))*100)
-            task.set_progress(progress, socket=socket)
-        except:
-            pass
+    # Image headers are read by a pool of threads, and new images are
+    # inserted in batches
+    with ThreadPoolExecutor(Config.SCAN_THREADS) as pool:
+        for path, visited in manifest.walk(full=full):
 
-        if root.split('/')[-1].startswith('.'):
-            continue
-        
-        for file in files:
-            path = os.path.join(root, file)
+            task.set_progress(min(visited / expected * 100, 99), socket=socket)
+
+            if path in known:
+                continue
+
+            known.add(path)
+            batch.append(path)
+            found += 1
 
-            if path.endswith(ImageModel.PATTERN):
-                db_image = ImageModel.objects(path=path).first()
+            if len(batch) >= Config.SCAN_BATCH_SIZE:
+                count += _insert_images(task, dataset, manifest, batch, pool)
+                batch = []
 
-                if db_image is not None:
-                    continue
+        count += _insert_images(task, dataset, manifest, batch, pool)
 
-                try:
-                    ImageModel.create_from_path(path, dataset.id).save()
-                    count += 1
-                    task.info(f"New file found: {path}")
-                except:
-                    task.warning(f"Could not read {path}")
+    manifest.save()
 
-    [thumbnail_generate_single_image.delay(image.id) for image in ImageModel.objects(regenerate_thumbnail=True).all()]
+    seconds = time.time() - started_at
+    rate = found / seconds if seconds > 0 else 0
+    task.info(f"Listed {manifest.listed} of {manifest.visited} directories, "
+              f"the others were unchanged ({seconds:.1f}s)")
+    task.info(f"Found {found} new file(s) ({rate:.0f} files/s)")
+
+    if count > 0:
+        # Bulk inserts skip TrackedDocument, so the dataset is bumped here
+        dataset.update(inc__version=1)
+
+    batches = thumbnail_generate_batches({'dataset_id': dataset.id})
+    task.info(f"Queued {batches} thumbnail batch(es)")
 
     task.info(f"Created {count} new image(s)")
     task.set_progress(100, socket=socket)
 
 
-__all__ = ["scan_dataset"]
\ No newline at end of file
+def _insert_images(task, dataset, manifest, paths, pool):
+    """
+    Reads the size of new image files and inserts them with one insert_many.
+    Directories of files which could not be read are listed again by the
+    next scan.
+
+    :return: number of images inserted
+    """
+    sizes = list(pool.map(probe_image, paths))
+
+    images = []
+    created_at = datetime.datetime.utcnow()
+    for path, size in zip(paths, sizes):
+        if size is None:
+            task.warning(f"Could not read {path}")
+            manifest.retry(path)
+            continue
+
+        images.append(ImageModel(
+            dataset_id=dataset.id,
+            file_name=os.path.basename(path),
+            path=path,
+            width=size[0],
+            height=size[1],
+            regenerate_thumbnail=True,
+            uploaded_by="System",
+            updated_at=created_at
+        ))
+
+    if len(images) == 0:
+        return 0
+
+    for image_id, image in zip(reserve_ids(ImageModel, len(images)), images):
+        image.id = image_id
+
+    try:
+        ImageModel._get_collection().insert_many(
+            [image.to_mongo() for image in images], ordered=False)
+    except BulkWriteError as e:
+        # Files already added to another dataset
+        for error in e.details.get('writeErrors', []):
+            task.warning(f"Could not add {error['op'].get('path')}: {error.get('errmsg')}")
+        return e.details.get('nInserted', 0)
+
+    return len(images)
+
+
+__all__ = ["scan_dataset"]
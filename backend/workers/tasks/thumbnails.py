@@ -1,5 +1,13 @@
-from database import ImageModel
+from config import Config
+from database import (
+    ImageModel,
+    render_thumbnail,
+    save_thumbnails,
+    thumbnail_overlays
+)
+from billiard import Pool
 from celery import task
+from PIL import Image
 
 
 @task
@@ -9,4 +17,80 @@ def thumbnail_generate_single_image(image_id):
     image.flag_thumbnail(flag=False)
 
 
-__all__ = ["thumbnail_generate_single_image"]
\ No newline at end of file
+def _render_thumbnail(job):
+    image_id, path, overlays, max_size, thumbnail_paths = job
+
+    try:
+        pil_image = render_thumbnail(path, overlays, max_size)
+        save_thumbnails(pil_image, thumbnail_paths)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    return image_id
+
+
+@task
+def thumbnail_generate_batch(image_ids):
+    """
+    Generates the thumbnails of a list of images in one task, rendering
+    them in a pool of THUMBNAIL_PROCESSES processes
+    """
+    images = ImageModel.objects(id__in=image_ids, regenerate_thumbnail=True) \
+        .only('id', 'path')
+    images = list(images)
+    if len(images) == 0:
+        return 0
+
+    overlays = thumbnail_overlays([image.id for image in images])
+    max_size = (ImageModel.MAX_THUMBNAIL_DIM[1], ImageModel.MAX_THUMBNAIL_DIM[0])
+
+    jobs = [
+        (image.id, image.path, overlays[image.id], max_size, image.thumbnail_paths())
+        for image in images
+    ]
+
+    # The pool only lives for the batch, so idle workers of the celery
+    # prefork pool do not keep rendering processes around
+    processes = min(Config.THUMBNAIL_PROCESSES, len(jobs))
+    if processes > 1:
+        with Pool(processes) as pool:
+            results = pool.map(_render_thumbnail, jobs)
+    else:
+        results = list(map(_render_thumbnail, jobs))
+    done = [image_id for image_id in results if image_id is not None]
+
+    ImageModel.objects(id__in=done).update(set__regenerate_thumbnail=False)
+
+    return len(done)
+
+
+def thumbnail_generate_batches(query):
+    """
+    Queues thumbnail_generate_batch tasks for the images matching a query
+    which need a new thumbnail, THUMBNAIL_BATCH_SIZE images per task
+
+    :param query: query on the images collection (e.g. {'dataset_id': 1})
+    :return: number of tasks queued
+    """
+    query = dict(query, regenerate_thumbnail=True)
+    images = ImageModel._get_collection().find(query, {'_id': 1})
+
+    batches = 0
+    batch = []
+    for image in images:
+        batch.append(image['_id'])
+
+        if len(batch) >= Config.THUMBNAIL_BATCH_SIZE:
+            thumbnail_generate_batch.delay(batch)
+            batches += 1
+            batch = []
+
+    if len(batch) > 0:
+        thumbnail_generate_batch.delay(batch)
+        batches += 1
+
+    return batches
+
+
+__all__ = ["thumbnail_generate_single_image", "thumbnail_generate_batch",
+           "thumbnail_generate_batches"]
@@ -0,0 +1,33 @@
+from config import Config
+from database import ImageModel
+from celery import task
+
+from ..tile_util import TilePyramid
+
+
+@task
+def generate_tiles(image_id):
+    """
+    Builds the deep zoom tile pyramid of an image, unless it is already
+    built from the current version of the image
+    """
+    image = ImageModel.objects(id=image_id).only('id', 'path').first()
+    if image is None:
+        return False
+
+    pyramid = TilePyramid(image.tiles_path())
+    try:
+        if pyramid.is_current(image.path):
+            return False
+
+        pyramid.build(image.path, Config.TILE_SIZE, Config.TILE_QUALITY)
+    except FileNotFoundError:
+        # The image file was removed since the build was queued
+        return False
+    finally:
+        pyramid.release()
+
+    return True
+
+
+__all__ = ["generate_tiles"]
@@ -0,0 +1,313 @@
+from PIL import Image
+
+from .scan_util import pixel_limit_lifted
+
+import collections
+import threading
+import struct
+import json
+import math
+import mmap
+import time
+import io
+import os
+
+
+# Descriptors and memory maps of the pyramids read by this process
+_open_pyramids = collections.OrderedDict()
+_open_lock = threading.Lock()
+MAX_OPEN_PYRAMIDS = 64
+
+# Length of the descriptor, stored in the last bytes of a pack
+_TRAILER = struct.Struct('<Q')
+
+
+class TilePyramid:
+    """
+    Deep zoom (DZI) tile pyramid of an image. Level 0 is a single pixel and
+    every level doubles the size of the previous one up to the full
+    resolution of the image. Tiles of every level are encoded once and
+    packed into one file, followed by a descriptor holding their offsets,
+    so a rebuilt pyramid replaces the previous one in one rename.
+    """
+
+    #: Seconds after which a build which did not finish can be queued again
+    PENDING_TIMEOUT = 3600
+
+    def __init__(self, path):
+        """
+        :param path: path of the pack file
+        """
+        self.path = path
+        self.pending_path = f"{path}.pending"
+
+    @staticmethod
+    def num_levels(width, height):
+        return math.ceil(math.log2(max(width, height, 1))) + 1
+
+    def is_current(self, source):
+        """
+        Returns True if the pyramid was built from the current version of
+        the source image
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                descriptor = self._read_descriptor(f)
+            source_mtime = os.stat(source).st_mtime_ns
+        except (OSError, ValueError):
+            return False
+
+        return descriptor.get('source_mtime') == source_mtime
+
+    def reserve(self):
+        """
+        Marks the pyramid as being built, so concurrent requests queue a
+        single build
+
+        :return: False if another build is pending
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        try:
+            os.close(os.open(self.pending_path,
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+
+        try:
+            age = time.time() - os.stat(self.pending_path).st_mtime
+        except FileNotFoundError:
+            # The pending build just finished
+            return False
+
+        if age < self.PENDING_TIMEOUT:
+            return False
+
+        # The build was lost, e.g. with the worker running it
+        os.utime(self.pending_path)
+        return True
+
+    def release(self):
+        """
+        Removes the mark set by reserve once a build finished or failed
+        """
+        try:
+            os.remove(self.pending_path)
+        except FileNotFoundError:
+            pass
+
+    def build(self, source, tile_size=256, quality=85):
+        """
+        Builds the pyramid of an image. Tiles of the full resolution level
+        are cut from the source one row of tiles at a time, every lower
+        level is built from the tiles of the level above it, so only one
+        decoded copy of the source is held in memory.
+
+        :param source: path of the image
+        :param tile_size: width and height of tiles in pixels
+        :param quality: JPEG quality of tiles
+        :return: descriptor of the pyramid
+        """
+        source_mtime = os.stat(source).st_mtime_ns
+
+        # Pyramids are built for images larger than Pillow's decompression
+        # bomb limit
+        with pixel_limit_lifted():
+            image = Image.open(source)
+
+        width, height = image.size
+        num_levels = self.num_levels(width, height)
+        levels = [None] * num_levels
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+
+        with open(temp_path, 'w+b') as f:
+            writer = _TileWriter(f, quality)
+
+            levels[-1] = _level(width, height, tile_size)
+            with image:
+                for row in range(levels[-1]['rows']):
+                    upper = row * tile_size
+                    strip = image.crop((
+                        0, upper, width, min(upper + tile_size, height)
+                    )).convert('RGB')
+
+                    for column in range(levels[-1]['columns']):
+                        left = column * tile_size
+                        writer.write(strip.crop((
+                            left, 0, min(left + tile_size, width), strip.height
+                        )))
+            levels[-1]['offsets'] = writer.offsets()
+
+            for level in reversed(range(num_levels - 1)):
+                above = levels[level + 1]
+                current = _level(math.ceil(above['width'] / 2),
+                                 math.ceil(above['height'] / 2), tile_size)
+
+                for row in range(current['rows']):
+                    for column in range(current['columns']):
+                        writer.write(_downsample(
+                            writer, above, column, row, tile_size))
+
+                current['offsets'] = writer.offsets()
+                levels[level] = current
+
+            descriptor = {
+                'width': width,
+                'height': height,
+                'tile_size': tile_size,
+                'overlap': 0,
+                'format': 'jpeg',
+                'source_mtime': source_mtime,
+                'levels': levels
+            }
+
+            data = json.dumps(descriptor).encode('utf-8')
+            f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.write(_TRAILER.pack(len(data)))
+
+        os.replace(temp_path, self.path)
+
+        return descriptor
+
+    @staticmethod
+    def _read_descriptor(f):
+        f.seek(-_TRAILER.size, os.SEEK_END)
+        length, = _TRAILER.unpack(f.read(_TRAILER.size))
+        f.seek(-_TRAILER.size - length, os.SEEK_END)
+        return json.loads(f.read(length).decode('utf-8'))
+
+    def _open(self):
+        """
+        Returns the descriptor and a memory map of the pack file, kept open
+        between calls until the pyramid is rebuilt
+        """
+        stat = os.stat(self.path)
+        version = (stat.st_ino, stat.st_mtime_ns)
+
+        with _open_lock:
+            opened = _open_pyramids.get(self.path)
+            if opened is not None and opened[0] == version:
+                _open_pyramids.move_to_end(self.path)
+                return opened[1], opened[2]
+
+        # The descriptor and the tiles are read from the same file, even if
+        # it is replaced meanwhile
+        with open(self.path, 'rb') as f:
+            descriptor = self._read_descriptor(f)
+            pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+            version = (stat.st_ino, stat.st_mtime_ns)
+
+        with _open_lock:
+            _open_pyramids[self.path] = (version, descriptor, pack)
+            _open_pyramids.move_to_end(self.path)
+            # Maps are closed once no request reads them anymore
+            while len(_open_pyramids) > MAX_OPEN_PYRAMIDS:
+                _open_pyramids.popitem(last=False)
+
+        return descriptor, pack
+
+    def descriptor(self):
+        """
+        Returns the descriptor of the pyramid, or None if it is not built
+        """
+        try:
+            return self._open()[0]
+        except FileNotFoundError:
+            return None
+
+    def read(self, level, column, row):
+        """
+        Returns an encoded tile, or None if the pyramid is not built or has
+        no such tile
+        """
+        try:
+            descriptor, pack = self._open()
+        except FileNotFoundError:
+            return None
+
+        levels = descriptor['levels']
+        if not 0 <= level < len(levels):
+            return None
+
+        level = levels[level]
+        if not (0 <= column < level['columns'] and 0 <= row < level['rows']):
+            return None
+
+        index = row * level['columns'] + column
+        start, end = level['offsets'][index], level['offsets'][index + 1]
+
+        return pack[start:end]
+
+
+def _level(width, height, tile_size):
+    return {
+        'width': width,
+        'height': height,
+        'columns': math.ceil(width / tile_size),
+        'rows': math.ceil(height / tile_size)
+    }
+
+
+def _downsample(writer, above, column, row, tile_size):
+    """
+    Builds a tile from the (up to) four tiles of the level above it
+    """
+    left, upper = column * tile_size * 2, row * tile_size * 2
+    region = Image.new('RGB', (
+        min(tile_size * 2, above['width'] - left),
+        min(tile_size * 2, above['height'] - upper)
+    ))
+
+    for y in range(2):
+        for x in range(2):
+            above_column, above_row = column * 2 + x, row * 2 + y
+            if above_column >= above['columns'] or above_row >= above['rows']:
+                continue
+
+            index = above_row * above['columns'] + above_column
+            tile = writer.read(above['offsets'][index],
+                               above['offsets'][index + 1])
+            region.paste(tile, (x * tile_size, y * tile_size))
+
+    return region.resize((
+        math.ceil(region.width / 2),
+        math.ceil(region.height / 2)
+    ), Image.BOX)
+
+
+class _TileWriter:
+    """
+    Appends encoded tiles to a pack file being built, and reads back the
+    tiles of the level above when building the next one
+    """
+
+    def __init__(self, f, quality):
+        self.f = f
+        self.quality = quality
+        self.position = 0
+        self._offsets = [0]
+
+    def write(self, tile):
+        tile_io = io.BytesIO()
+        tile.save(tile_io, "JPEG", quality=self.quality)
+
+        self.f.seek(self.position)
+        self.position += self.f.write(tile_io.getvalue())
+        self._offsets.append(self.position)
+
+    def read(self, start, end):
+        self.f.seek(start)
+        return Image.open(io.BytesIO(self.f.read(end - start)))
+
+    def offsets(self):
+        """
+        Returns the offsets of the tiles written since the last call
+        """
+        offsets = self._offsets
+        self._offsets = [self.position]
+        return offsets
@@ -9,7 +9,9 @@ export default {
   delete(id) {
     return axios.delete(baseURL + id);
   },
-  getLogs(id) {
-    return axios.get(baseURL + id + "/logs");
+  getLogs(id, cursor = 0, limit = 1000, tail = false) {
+    return axios.get(baseURL + id + "/logs", {
+      params: { cursor: cursor, limit: limit, tail: tail }
+    });
   }
 };